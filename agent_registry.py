@@ -0,0 +1,96 @@
+# Declarative registry of the chat agents. Each agent is described by an AgentSpec
+# (system prompt, human template, whether it sees the conversation history and which
+# model runs it). The prompt template and its `prompt | llm` chain are compiled once,
+# on the agent's first use, and every later request reuses them, so registering an
+# agent adds nothing to startup and nothing per request.
+import threading
+from typing import Any, Dict, Iterable, List
+
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+
+class AgentSpec:
+    __slots__ = ("name", "system", "human", "history", "llm")
+
+    def __init__(self, name: str, system: str, human: str = "{message}", history: bool = True, llm: str = "agent"):
+        self.name = name
+        self.system = system
+        self.human = human
+        self.history = history  # Adds a `messages` placeholder between the system and human turns
+        self.llm = llm  # Key into the registry's models
+
+    def fingerprint(self) -> int:
+        return hash((self.system, self.human, self.history, self.llm))
+
+    def build_prompt(self) -> ChatPromptTemplate:
+        messages: List[Any] = [("system", self.system)]
+        if self.history:
+            messages.append(MessagesPlaceholder(variable_name="messages"))
+        messages.append(("human", self.human))
+        return ChatPromptTemplate.from_messages(messages)
+
+
+class CompiledAgent:
+    __slots__ = ("spec", "llm", "prompt", "chain", "input_variables")
+
+    def __init__(self, spec: AgentSpec, llm: Any):
+        self.spec = spec
+        self.llm = llm
+        self.prompt = spec.build_prompt()
+        self.chain = self.prompt | llm
+        self.input_variables = frozenset(self.prompt.input_variables)
+
+
+class AgentRegistry:
+    def __init__(self, llms: Dict[str, Any], specs: Iterable[AgentSpec] = ()):
+        self.llms = llms
+        self._specs: Dict[Any, AgentSpec] = {}
+        self._compiled: Dict[Any, CompiledAgent] = {}
+        self._lock = threading.Lock()
+        self.compiles = 0
+        self.lookups = 0
+        for spec in specs:
+            self.register(spec)
+
+    def register(self, spec: AgentSpec) -> None:
+        with self._lock:
+            self._specs[spec.name] = spec
+            # Replacing a spec drops its chain; the new one is compiled on next use
+            self._compiled.pop(spec.name, None)
+
+    def set_llms(self, llms: Dict[str, Any]) -> None:
+        """Swap the models; every chain is recompiled on its next use."""
+        with self._lock:
+            self.llms = llms
+            self._compiled.clear()
+
+    def spec(self, name: Any) -> AgentSpec:
+        return self._specs[name]
+
+    def get(self, name: Any) -> CompiledAgent:
+        self.lookups += 1
+        agent = self._compiled.get(name)
+        if agent is None:
+            with self._lock:
+                agent = self._compiled.get(name)
+                if agent is None:
+                    spec = self._specs[name]
+                    agent = self._compiled[name] = CompiledAgent(spec, self.llms[spec.llm])
+                    self.compiles += 1
+        return agent
+
+    def chain(self, name: Any):
+        return self.get(name).chain
+
+    def compile_all(self) -> None:
+        """Compile every registered agent up front (e.g. to warm a long-lived worker)."""
+        for name in list(self._specs):
+            self.get(name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "registered": len(self._specs),
+            "compiled": sorted(getattr(name, "value", name) for name in self._compiled),
+            "compiles": self.compiles,
+            "lookups": self.lookups,
+        }
@@ -0,0 +1,219 @@
+# Splits long recordings into overlapping segments that can be transcribed in parallel,
+# and stitches the segment transcripts back together.
+#
+# MP3 is cut on frame boundaries by walking the frame headers (no decoding, no ffmpeg),
+# so every segment is itself a valid MP3 stream. PCM WAV is cut with the `wave` module.
+# Any other format is sent as a single segment.
+import io
+import re
+import threading
+import wave
+from typing import BinaryIO, Callable, List, Optional, Tuple
+
+SEGMENT_SECONDS = 60.0
+OVERLAP_SECONDS = 3.0
+# Recordings shorter than this are not worth splitting
+MIN_SPLIT_SECONDS = 90.0
+
+# MPEG audio Layer III tables, indexed by the header fields
+_MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),  # MPEG-1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),  # MPEG-2 and 2.5
+}
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+class Segment:
+    __slots__ = ("index", "start", "end", "filename", "_load")
+
+    def __init__(self, index: int, start: float, end: Optional[float], filename: str, load: Callable[[], BinaryIO]):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.filename = filename
+        self._load = load
+
+    def load(self):
+        """The segment's audio: a file object for whole-file segments, bytes otherwise."""
+        return self._load()
+
+
+def split_audio(
+    file: BinaryIO,
+    filename: str,
+    segment_seconds: float = SEGMENT_SECONDS,
+    overlap_seconds: float = OVERLAP_SECONDS,
+) -> List[Segment]:
+    """Plan the segments of `file`. Blocking (reads frame headers), so run it off the event loop."""
+    lock = threading.Lock()  # Segments are loaded from worker threads sharing one file position
+    name = filename.lower()
+    try:
+        if name.endswith(".mp3") or name.endswith(".mpga") or name.endswith(".mpeg"):
+            segments = _split_mp3(file, filename, segment_seconds, overlap_seconds, lock)
+        elif name.endswith(".wav"):
+            segments = _split_wav(file, filename, segment_seconds, overlap_seconds, lock)
+        else:
+            segments = None
+    except (wave.Error, EOFError, ValueError) as e:
+        print(f"Could not split {filename}, sending it whole: {str(e)}")
+        segments = None
+    finally:
+        file.seek(0)
+
+    if not segments:
+        # Whole file, duration unknown
+        return [Segment(0, 0.0, None, filename, lambda: file)]
+    return segments
+
+
+def _windows(duration: float, segment_seconds: float, overlap_seconds: float) -> List[Tuple[float, float]]:
+    """(start, end) times: fixed steps, each window reaching back `overlap_seconds` into the previous one."""
+    if duration < max(MIN_SPLIT_SECONDS, segment_seconds):
+        return []
+    windows = []
+    step = 0.0
+    while step < duration:
+        end = step + segment_seconds
+        # Fold a short tail into the last window instead of sending a sliver on its own
+        if duration - end < segment_seconds / 4:
+            end = duration
+        windows.append((max(0.0, step - overlap_seconds), end))
+        step = end
+    return windows
+
+
+def _mp3_frames(file: BinaryIO) -> Tuple[List[int], float]:
+    """Byte offsets of every MPEG Layer III frame (plus the end offset) and the frame duration."""
+    file.seek(0)
+    header = file.read(10)
+    offset = 0
+    if header[:3] == b"ID3":
+        size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        offset = 10 + size + (10 if header[5] & 0x10 else 0)
+
+    offsets: List[int] = []
+    frame_seconds: Optional[float] = None
+    while True:
+        file.seek(offset)
+        data = file.read(4)
+        if len(data) < 4:
+            break
+        length, seconds = _mp3_frame(data)
+        if not length:
+            if offsets and data[:3] == b"TAG":
+                break  # ID3v1 trailer
+            # Lost sync (junk between frames): scan for the next frame header
+            next_sync = _find_sync(file, offset + 1)
+            if next_sync is None:
+                break
+            offset = next_sync
+            continue
+        if frame_seconds is None:
+            frame_seconds = seconds
+        offsets.append(offset)
+        offset += length
+
+    if not offsets or frame_seconds is None:
+        raise ValueError("no MPEG Layer III frames found")
+    offsets.append(min(offset, file.seek(0, io.SEEK_END)))
+    return offsets, frame_seconds
+
+
+def _mp3_frame(data: bytes) -> Tuple[int, float]:
+    """(frame length in bytes, frame duration in seconds) for a Layer III header, or (0, 0) if invalid."""
+    if data[0] != 0xFF or data[1] & 0xE0 != 0xE0:
+        return 0, 0.0
+    version = (data[1] >> 3) & 0x03
+    layer = (data[1] >> 1) & 0x03
+    bitrate_index = data[2] >> 4
+    rate_index = (data[2] >> 2) & 0x03
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return 0, 0.0
+    bitrate = _MP3_BITRATES[1 if version == 3 else 2][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    padding = (data[2] >> 1) & 0x01
+    samples = 1152 if version == 3 else 576
+    return samples // 8 * bitrate // sample_rate + padding, samples / sample_rate
+
+
+def _find_sync(file: BinaryIO, offset: int, limit: int = 64 * 1024) -> Optional[int]:
+    file.seek(offset)
+    data = file.read(limit)
+    position = data.find(b"\xff")
+    while position != -1 and position + 4 <= len(data):
+        if _mp3_frame(data[position:position + 4])[0]:
+            return offset + position
+        position = data.find(b"\xff", position + 1)
+    return None
+
+
+def _split_mp3(file: BinaryIO, filename: str, segment_seconds: float, overlap_seconds: float, lock) -> List[Segment]:
+    offsets, frame_seconds = _mp3_frames(file)
+    frames = len(offsets) - 1
+    segments = []
+    for index, (start, end) in enumerate(_windows(frames * frame_seconds, segment_seconds, overlap_seconds)):
+        first = int(start / frame_seconds)
+        last = min(frames, int(round(end / frame_seconds)))
+
+        def load(byte_start=offsets[first], byte_end=offsets[last]) -> bytes:
+            with lock:
+                file.seek(byte_start)
+                return file.read(byte_end - byte_start)
+
+        segments.append(Segment(index, first * frame_seconds, last * frame_seconds, f"part{index}-{filename}", load))
+    return segments
+
+
+def _split_wav(file: BinaryIO, filename: str, segment_seconds: float, overlap_seconds: float, lock) -> List[Segment]:
+    with wave.open(file, "rb") as reader:
+        params = reader.getparams()
+    segments = []
+    for index, (start, end) in enumerate(_windows(params.nframes / params.framerate, segment_seconds, overlap_seconds)):
+        first = int(start * params.framerate)
+        last = min(params.nframes, int(end * params.framerate))
+
+        def load(first=first, last=last) -> bytes:
+            with lock:
+                file.seek(0)
+                with wave.open(file, "rb") as reader:
+                    reader.setpos(first)
+                    frames = reader.readframes(last - first)
+            buffer = io.BytesIO()
+            with wave.open(buffer, "wb") as writer:
+                writer.setparams(params)
+                writer.writeframes(frames)
+            return buffer.getvalue()
+
+        segments.append(Segment(index, first / params.framerate, last / params.framerate, f"part{index}-{filename}", load))
+    return segments
+
+
+_WORD = re.compile(r"\w+")
+
+
+def _words(text: str) -> List[str]:
+    return [word.lower() for word in _WORD.findall(text)]
+
+
+def stitch(previous: str, text: str, max_overlap_words: int = 40) -> str:
+    """Drop the start of `text` that repeats the end of `previous` (the overlapping audio).
+
+    Looks for the longest run of words ending `previous` that reappears near the start of
+    `text`, allowing a couple of leading words that were cut mid-word at the boundary.
+    Returns what remains of `text`, with its original spelling and punctuation.
+    """
+    tail = _words(previous)[-max_overlap_words:]
+    tokens = list(_WORD.finditer(text))
+    head = [token.group().lower() for token in tokens[:max_overlap_words + 2]]
+    if not tail or not head:
+        return text.strip()
+
+    for length in range(min(len(tail), len(head)), 0, -1):
+        # A single short repeated word is as likely to be a coincidence as an overlap
+        if length == 1 and len(head) > 1 and len(tail[-1]) < 4:
+            break
+        for skip in range(0, min(3, len(head) - length + 1) if length > 1 else 1):
+            if head[skip:skip + length] == tail[-length:]:
+                cut = tokens[skip + length - 1].end()
+                return text[cut:].lstrip(" ,.;:!?-").strip()
+    return text.strip()
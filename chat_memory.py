@@ -1,53 +1,141 @@
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+import asyncio
 import sqlite3
 import json
-from typing import List
-from pydantic.v1 import BaseModel
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Optional, Sequence
+
+DB_PATH = "chat_history.db"
+
+# Statements are module constants so every call hits the connection's prepared-statement cache
+SELECT_ALL_SQL = "SELECT message FROM chat_messages WHERE session_id = ? ORDER BY seq"
+SELECT_LAST_SQL = """SELECT message FROM (
+                         SELECT seq, message FROM chat_messages
+                         WHERE session_id = ? ORDER BY seq DESC LIMIT ?
+                     ) ORDER BY seq"""
+APPEND_SQL = """INSERT INTO chat_messages (session_id, seq, message)
+                VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM chat_messages WHERE session_id = ?), ?)"""
+DELETE_SQL = "DELETE FROM chat_messages WHERE session_id = ?"
+
+
+class SQLiteConnectionManager:
+    """Hands out one long-lived, WAL-mode connection per thread and sets up the schema once per process."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # With WAL, NORMAL only syncs at checkpoints instead of on every commit
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA cache_size=-8192")  # 8 MiB page cache
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._ensure_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self, conn: sqlite3.Connection) -> None:
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS chat_messages (
+                        session_id TEXT NOT NULL,
+                        seq INTEGER NOT NULL,
+                        message TEXT NOT NULL,
+                        PRIMARY KEY (session_id, seq)
+                    ) WITHOUT ROWID
+                """)
+                _migrate_legacy_table(conn)
+            self._schema_ready = True
+
+
+db = SQLiteConnectionManager(DB_PATH)
+
+# History I/O from async callers runs on this dedicated thread instead of the event loop
+_io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-history-io")
+
+
+async def _run_io(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_io_executor, partial(func, *args))
+
 
 class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    """Chat history stored as one row per message, keyed on (session_id, seq)."""
+
     def __init__(self, session_id: str):
         self.session_id = session_id
-        self._init_db()
-    
-    def _init_db(self):
-        with sqlite3.connect("chat_history.db") as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS chat_history
-                (session_id TEXT PRIMARY KEY, messages TEXT)
-            """)
-    
+
     @property
     def messages(self) -> List[BaseMessage]:
-        with sqlite3.connect("chat_history.db") as conn:
-            cursor = conn.execute(
-                "SELECT messages FROM chat_history WHERE session_id = ?",
-                (self.session_id,)
-            )
-            row = cursor.fetchone()
-            if row:
-                messages_dict = json.loads(row[0])
-                return messages_from_dict(messages_dict)
-        return []
-    
+        return self.get_messages()
+
+    def get_messages(self, limit: Optional[int] = None) -> List[BaseMessage]:
+        """Return the session's messages in order, or only the last `limit` of them."""
+        conn = db.connection()
+        if limit is None:
+            rows = conn.execute(SELECT_ALL_SQL, (self.session_id,)).fetchall()
+        else:
+            rows = conn.execute(SELECT_LAST_SQL, (self.session_id, limit)).fetchall()
+        return messages_from_dict([json.loads(row[0]) for row in rows])
+
     def add_messages(self, messages: List[BaseMessage]) -> None:
-        current_messages = self.messages
-        current_messages.extend(messages)
-        messages_dict = messages_to_dict(current_messages)
-        
-        with sqlite3.connect("chat_history.db") as conn:
-            conn.execute(
-                """INSERT OR REPLACE INTO chat_history (session_id, messages)
-                   VALUES (?, ?)""",
-                (self.session_id, json.dumps(messages_dict))
+        # Each insert takes the next seq from the primary key index, so appending
+        # never touches the rows already stored for the session.
+        with db.connection() as conn:
+            conn.executemany(
+                APPEND_SQL,
+                [
+                    (self.session_id, self.session_id, json.dumps(message_to_dict(message)))
+                    for message in messages
+                ]
             )
-    
+
     def clear(self) -> None:
-        with sqlite3.connect("chat_history.db") as conn:
-            conn.execute(
-                "DELETE FROM chat_history WHERE session_id = ?",
-                (self.session_id,)
-            )
+        with db.connection() as conn:
+            conn.execute(DELETE_SQL, (self.session_id,))
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        return await _run_io(self.get_messages)
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        await _run_io(self.add_messages, list(messages))
+
+    async def aclear(self) -> None:
+        await _run_io(self.clear)
+
+
+def _migrate_legacy_table(conn: sqlite3.Connection) -> None:
+    """Move sessions from the old one-JSON-blob-per-session `chat_history` table into `chat_messages`."""
+    legacy = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_history'"
+    ).fetchone()
+    if not legacy:
+        return
+
+    for session_id, blob in conn.execute("SELECT session_id, messages FROM chat_history").fetchall():
+        conn.executemany(
+            "INSERT OR IGNORE INTO chat_messages (session_id, seq, message) VALUES (?, ?, ?)",
+            [
+                (session_id, seq, json.dumps(message))
+                for seq, message in enumerate(json.loads(blob), start=1)
+            ]
+        )
+    conn.execute("DROP TABLE chat_history")
+
 
 def get_session_history(session_id: str) -> BaseChatMessageHistory:
-    return SQLiteChatMessageHistory(session_id=session_id) 
\ No newline at end of file
+    return SQLiteChatMessageHistory(session_id=session_id)
@@ -0,0 +1,228 @@
+# Long-lived HTTP clients shared by every upstream SDK (Perplexity via OpenAI, Groq and
+# the LangChain ChatGroq models). One pooled httpx client per interface (sync and async)
+# keeps TCP/TLS connections alive across requests instead of every service building
+# its own pool. The pools are opened in the FastAPI lifespan and closed on shutdown.
+#
+# Each request carries an httpcore trace hook, so we can count how many requests were
+# served on an already-open connection versus one that had to be established, and every
+# response's rate-limit headers are passed to the upstream scheduler.
+#
+# The groq and openai SDKs are only imported when their client is first built, which
+# keeps them out of the API process's import time (see util/import_budget.py).
+import importlib.util
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+
+from upstream_scheduler import scheduler
+
+if TYPE_CHECKING:
+    from groq import AsyncGroq, Groq
+    from openai import AsyncOpenAI, OpenAI
+
+load_dotenv()
+
+PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
+
+# HTTP/2 multiplexes concurrent calls over one connection, but needs the optional `h2` package
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+POOL_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20")),
+    keepalive_expiry=float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60")),
+)
+
+
+class ConnectionStats:
+    """Per-host request and new-connection counters, fed by httpx event hooks and httpcore traces."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hosts: Dict[str, Dict[str, int]] = {}
+
+    def _host(self, host: str) -> Dict[str, int]:
+        counters = self.hosts.get(host)
+        if counters is None:
+            counters = self.hosts[host] = {"requests": 0, "connections": 0}
+        return counters
+
+    def record_request(self, host: str) -> None:
+        with self._lock:
+            self._host(host)["requests"] += 1
+
+    def record_connection(self, host: str) -> None:
+        with self._lock:
+            self._host(host)["connections"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hosts = {host: dict(counters) for host, counters in self.hosts.items()}
+        requests = sum(counters["requests"] for counters in hosts.values())
+        connections = sum(counters["connections"] for counters in hosts.values())
+        for counters in hosts.values():
+            counters["reuse_rate"] = _reuse_rate(counters["requests"], counters["connections"])
+        return {
+            "requests": requests,
+            "connections": connections,
+            "reuse_rate": _reuse_rate(requests, connections),
+            "hosts": hosts,
+        }
+
+
+def _reuse_rate(requests: int, connections: int) -> float:
+    return max(requests - connections, 0) / requests if requests else 0.0
+
+
+def timeout_errors() -> Tuple[type, ...]:
+    """Per-call timeout exceptions of the Perplexity (OpenAI) and Groq SDKs.
+
+    Only called from `except` clauses, i.e. after an SDK call has raised, so the
+    SDKs are already imported by then.
+    """
+    from groq import APITimeoutError as GroqTimeoutError
+    from openai import APITimeoutError as OpenAITimeoutError
+    return (OpenAITimeoutError, GroqTimeoutError)
+
+
+class UpstreamClients:
+    def __init__(self, http2: Optional[bool] = None):
+        if http2 is None:
+            http2 = HTTP2_AVAILABLE and os.getenv("UPSTREAM_HTTP2", "1").lower() not in ("0", "false", "no")
+        self.http2 = http2
+        self.connection_stats = ConnectionStats()
+        self._http: Optional[httpx.Client] = None
+        self._async_http: Optional[httpx.AsyncClient] = None
+        self._sdk: Dict[str, Any] = {}
+        self._lock = threading.RLock()  # SDK factories open the pools while holding it
+
+    # Pools are created on first use, so scripts outside the app (llm-test.py, util/) still work
+    @property
+    def http(self) -> httpx.Client:
+        if self._http is None:
+            with self._lock:
+                if self._http is None:
+                    self._http = httpx.Client(
+                        limits=POOL_LIMITS,
+                        http2=self.http2,
+                        event_hooks={"request": [self._on_request], "response": [self._on_response]},
+                    )
+        return self._http
+
+    @property
+    def async_http(self) -> httpx.AsyncClient:
+        if self._async_http is None:
+            with self._lock:
+                if self._async_http is None:
+                    self._async_http = httpx.AsyncClient(
+                        limits=POOL_LIMITS,
+                        http2=self.http2,
+                        event_hooks={"request": [self._on_async_request], "response": [self._on_async_response]},
+                    )
+        return self._async_http
+
+    def _on_request(self, request: httpx.Request) -> None:
+        host = request.url.host
+        self.connection_stats.record_request(host)
+
+        def trace(event: str, info: Dict[str, Any]) -> None:
+            if event == "connection.connect_tcp.started":
+                self.connection_stats.record_connection(host)
+
+        request.extensions["trace"] = trace
+
+    async def _on_async_request(self, request: httpx.Request) -> None:
+        host = request.url.host
+        self.connection_stats.record_request(host)
+
+        async def trace(event: str, info: Dict[str, Any]) -> None:
+            if event == "connection.connect_tcp.started":
+                self.connection_stats.record_connection(host)
+
+        request.extensions["trace"] = trace
+
+    def _on_response(self, response: httpx.Response) -> None:
+        scheduler.observe(response.status_code, response.headers)
+
+    async def _on_async_response(self, response: httpx.Response) -> None:
+        scheduler.observe(response.status_code, response.headers)
+
+    def _client(self, name: str, factory) -> Any:
+        client = self._sdk.get(name)
+        if client is None:
+            with self._lock:
+                client = self._sdk.get(name)
+                if client is None:
+                    client = self._sdk[name] = factory()
+        return client
+
+    # SDK retries are off: upstream_scheduler retries 429s itself, through the rate-limit budgets
+    @property
+    def perplexity(self) -> "OpenAI":
+        def build():
+            from openai import OpenAI
+            return OpenAI(
+                api_key=os.getenv("PERPLEXITY_API_KEY"),
+                base_url=PERPLEXITY_BASE_URL,
+                http_client=self.http,
+                max_retries=0,
+            )
+        return self._client("perplexity", build)
+
+    @property
+    def async_perplexity(self) -> "AsyncOpenAI":
+        def build():
+            from openai import AsyncOpenAI
+            return AsyncOpenAI(
+                api_key=os.getenv("PERPLEXITY_API_KEY"),
+                base_url=PERPLEXITY_BASE_URL,
+                http_client=self.async_http,
+                max_retries=0,
+            )
+        return self._client("async_perplexity", build)
+
+    @property
+    def groq(self) -> "Groq":
+        def build():
+            from groq import Groq
+            return Groq(api_key=os.getenv("GROQ_API_KEY"), http_client=self.http, max_retries=0)
+        return self._client("groq", build)
+
+    @property
+    def async_groq(self) -> "AsyncGroq":
+        def build():
+            from groq import AsyncGroq
+            return AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), http_client=self.async_http, max_retries=0)
+        return self._client("async_groq", build)
+
+    def start(self) -> None:
+        """Open both pools up front so the first request does not pay for building them."""
+        self.http
+        self.async_http
+
+    async def aclose(self) -> None:
+        # The SDK clients only wrap the shared pools, closing the pools releases every connection
+        with self._lock:
+            http, async_http = self._http, self._async_http
+            self._http = self._async_http = None
+            self._sdk.clear()
+        if http is not None:
+            http.close()
+        if async_http is not None:
+            await async_http.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http2": self.http2,
+            "max_connections": POOL_LIMITS.max_connections,
+            "max_keepalive_connections": POOL_LIMITS.max_keepalive_connections,
+            "keepalive_expiry": POOL_LIMITS.keepalive_expiry,
+            **self.connection_stats.stats(),
+            "rate_limits": scheduler.stats(),
+        }
+
+
+upstream = UpstreamClients()
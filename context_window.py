@@ -0,0 +1,119 @@
+# Token-budgeted history for agent prompts. The most recent messages are passed
+# verbatim up to the agent's budget; anything older is folded into a rolling summary
+# that a small model updates in the background, so prompt size stays flat as a
+# conversation grows.
+import asyncio
+import contextvars
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+from session_store import SessionStore, StoredMessage, estimate_tokens
+from ttl_cache import TTLCache
+from upstream_scheduler import scheduler
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You maintain a running summary of a conversation between a UK careers assistant and a user.
+    Merge the new messages into the current summary.
+    Keep every fact about the user: jobs, skills, education, location, goals, constraints and decisions made.
+    Drop greetings and small talk. Reply with the updated summary only, in under 150 words."""),
+    ("human", "Current summary:\n{summary}\n\nNew messages:\n{transcript}")
+])
+
+
+class ContextWindowManager:
+    def __init__(
+        self,
+        sessions: SessionStore,
+        summary_llm,
+        budgets: Optional[Dict[str, int]] = None,
+        default_budget: int = 1500,
+    ):
+        self.sessions = sessions
+        self.set_llm(summary_llm)
+        self.budgets = budgets or {}
+        self.default_budget = default_budget
+
+        # session_id -> (summary text, absolute index of the first message not yet summarised)
+        self._summaries = TTLCache(maxsize=sessions.max_sessions, ttl=sessions.ttl)
+        self._pending: Dict[str, asyncio.Task] = {}
+
+        self.summaries_started = 0
+        self.summaries_completed = 0
+        self.summaries_failed = 0
+        self.trimmed_tokens = 0
+
+    def set_llm(self, summary_llm) -> None:
+        self.summary_llm = summary_llm
+        self.summary_chain = SUMMARY_PROMPT | summary_llm
+
+    def window(self, session_id: str, agent_type: str) -> List[BaseMessage]:
+        """Return the history to send to `agent_type`: the rolling summary plus the recent turns that fit its budget."""
+        offset, stored = self.sessions.snapshot(session_id)
+        budget = self.budgets.get(agent_type, self.default_budget)
+
+        # Walk back from the newest message until the budget is spent
+        used = 0
+        start = len(stored)
+        while start > 0 and used + stored[start - 1].tokens <= budget:
+            start -= 1
+            used += stored[start].tokens
+
+        history = [message.to_message() for message in stored[start:]]
+        if start == 0:
+            return history
+
+        self.trimmed_tokens += sum(message.tokens for message in stored[:start])
+        summary, summarized_upto = self._summaries.get(session_id, ("", offset))
+
+        # Fold messages that have left the window into the summary, off the request path
+        window_start = offset + start
+        if summarized_upto < window_start and session_id not in self._pending:
+            unsummarized = stored[max(summarized_upto - offset, 0):start]
+            self._schedule_summary(session_id, summary, unsummarized, window_start)
+
+        if summary:
+            history.insert(0, SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"))
+        return history
+
+    def _schedule_summary(self, session_id: str, summary: str, messages: List[StoredMessage], upto: int) -> None:
+        self.summaries_started += 1
+        # Run in a fresh context so the summariser's callbacks are not attached to the
+        # caller's run (and its tokens never leak into the agent's stream).
+        task = contextvars.Context().run(
+            asyncio.ensure_future, self._summarize(session_id, summary, messages, upto)
+        )
+        self._pending[session_id] = task
+
+    async def _summarize(self, session_id: str, summary: str, messages: List[StoredMessage], upto: int) -> None:
+        try:
+            transcript = "\n".join(f"{message.role}: {message.content}" for message in messages)
+            payload = {
+                "summary": summary or "(none yet)",
+                "transcript": transcript,
+            }
+            # Shares the model's Groq budget with the chat agents (see upstream_scheduler.py)
+            result = await scheduler.run(
+                "groq",
+                self.summary_llm.model_name,
+                lambda: self.summary_chain.ainvoke(payload),
+                tokens=estimate_tokens(payload["summary"]) + estimate_tokens(transcript) + self.summary_llm.max_tokens,
+            )
+            self._summaries.set(session_id, (result.content.strip(), upto))
+            self.summaries_completed += 1
+        except Exception as e:
+            print(f"Error updating conversation summary: {str(e)}")
+            self.summaries_failed += 1
+        finally:
+            self._pending.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "summaries": len(self._summaries),
+            "summaries_in_flight": len(self._pending),
+            "summaries_started": self.summaries_started,
+            "summaries_completed": self.summaries_completed,
+            "summaries_failed": self.summaries_failed,
+            "trimmed_tokens": self.trimmed_tokens,
+        }
@@ -0,0 +1,178 @@
+# Single owner of everything under datasets/. Files are parsed once into an immutable
+# snapshot of typed records; derived structures (search index, transition engine, the
+# YAML form of the occupation table) are built lazily per snapshot. A background
+# watcher swaps in a new snapshot when file contents change, so request paths never
+# touch the disk and every agent reads the same dataset version.
+import asyncio
+import hashlib
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import orjson
+
+DATASET_DIR = "datasets"
+
+
+class Occupation:
+    __slots__ = ("description", "code", "median")
+
+    def __init__(self, description: str, code: str, median: Optional[float]):
+        self.description = description
+        self.code = code
+        self.median = median
+
+
+class Region:
+    __slots__ = ("name", "code", "earnings", "parent_code")
+
+    def __init__(self, name: str, code: str, earnings: Optional[float], parent_code: Optional[str] = None):
+        self.name = name
+        self.code = code
+        self.earnings = earnings
+        self.parent_code = parent_code
+
+
+def _regions(entries: List[Dict], parent_code: Optional[str] = None) -> List[Region]:
+    """Flatten the nested region tree (counties carry their districts in `sub_regions`)."""
+    regions = []
+    for entry in entries:
+        regions.append(Region(entry["name"], entry["code"], entry.get("earnings"), parent_code))
+        regions.extend(_regions(entry.get("sub_regions", []), entry["code"]))
+    return regions
+
+
+def content_version(files: Dict[str, bytes]) -> str:
+    """Content hash, so the version is stable across restarts and only changes with the data."""
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(name.encode())
+        digest.update(files[name])
+    return digest.hexdigest()[:12]
+
+
+class DatasetSnapshot:
+    def __init__(self, files: Dict[str, bytes]):
+        self.version = content_version(files)
+
+        self.datasets: Dict[str, Any] = {name: orjson.loads(content) for name, content in files.items()}
+
+        self.occupations: Tuple[Occupation, ...] = tuple(
+            Occupation(entry["description"], entry["code"], entry["median"])
+            for entry in self.datasets.get("yr-earnings-occupation", {}).get("occupations", [])
+        )
+        self.occupation_medians = np.array(
+            [occupation.median if occupation.median is not None else np.nan for occupation in self.occupations],
+            dtype=np.float64,
+        )
+        self.annual_regions: Tuple[Region, ...] = tuple(
+            _regions(self.datasets.get("yr-earnings-region", {}).get("regions", []))
+        )
+        self.weekly_regions: Tuple[Region, ...] = tuple(
+            _regions(self.datasets.get("wk-earnings-region", {}).get("regions", []))
+        )
+
+        self._derived: Dict[str, Any] = {}
+        # Re-entrant: a factory may itself ask for another derived structure
+        self._lock = threading.RLock()
+
+    def derived(self, name: str, factory: Callable[["DatasetSnapshot"], Any]) -> Any:
+        """Build `factory(snapshot)` once per snapshot and return the cached result afterwards."""
+        value = self._derived.get(name)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = self._derived[name] = factory(self)
+        return value
+
+    @property
+    def occupation_index(self):
+        from occupation_index import OccupationIndex
+        return self.derived("occupation_index", lambda snapshot: OccupationIndex(snapshot.occupations))
+
+    @property
+    def occupation_yaml(self) -> str:
+        """The occupation table without codes, as in datasets/yr-earnings-occupation.yaml."""
+        def render(snapshot: "DatasetSnapshot") -> str:
+            import yaml
+            return yaml.dump(
+                {"occupations": [
+                    {"description": occupation.description, "median": occupation.median}
+                    for occupation in snapshot.occupations
+                ]},
+                sort_keys=False,
+                allow_unicode=True,
+            )
+        return self.derived("occupation_yaml", render)
+
+
+class DatasetRegistry:
+    def __init__(self, directory: str = DATASET_DIR):
+        self.directory = directory
+        self._snapshot: Optional[DatasetSnapshot] = None
+        self._stamps: Dict[str, Tuple[int, int]] = {}
+        self._reload_lock = threading.Lock()
+        self.reloads = 0
+
+    def current(self) -> DatasetSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.reload_if_changed()
+            snapshot = self._snapshot
+        return snapshot
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        stamps = {}
+        for entry in os.scandir(self.directory):
+            # The YAML table is a derived form of the occupation JSON and is rebuilt in memory
+            if entry.is_file() and entry.name.endswith(".json"):
+                stat = entry.stat()
+                stamps[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return stamps
+
+    def reload_if_changed(self) -> bool:
+        """Re-parse the datasets if any file was added, removed or modified. Returns True on reload."""
+        with self._reload_lock:
+            stamps = self._scan()
+            if self._snapshot is not None and stamps == self._stamps:
+                return False
+
+            files = {}
+            for name in stamps:
+                with open(os.path.join(self.directory, name), "rb") as file:
+                    files[name[:-len(".json")]] = file.read()
+            if self._snapshot is not None and content_version(files) == self._snapshot.version:
+                # Touched or copied over with the same content: keep the snapshot and everything derived from it
+                self._stamps = stamps
+                return False
+
+            # Swap in one assignment; readers holding the old snapshot finish on it undisturbed
+            snapshot = DatasetSnapshot(files)
+            self._snapshot = snapshot
+            self._stamps = stamps
+            self.reloads += 1
+            print(f"Loaded datasets version {snapshot.version}")
+            return True
+
+    async def watch(self, interval: float = 5.0) -> None:
+        """Poll file stamps off the event loop and hot-swap the snapshot when they change."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.reload_if_changed)
+            except Exception as e:
+                print(f"Error reloading datasets: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version if snapshot else None,
+            "files": sorted(self._stamps),
+            "reloads": self.reloads,
+            "occupations": len(snapshot.occupations) if snapshot else 0,
+        }
+
+
+registry = DatasetRegistry()
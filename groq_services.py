@@ -1,35 +1,237 @@
-import os
-from groq import Groq
-from dotenv import load_dotenv
+from typing import TYPE_CHECKING, Any, AsyncGenerator, Callable, Dict, List, Optional
+import numpy as np
+import asyncio
+import hashlib
 import json
+import re
+import time
+from dotenv import load_dotenv
 from models.user_profile import UserProfile
+from dataset_registry import Occupation, registry
+from clients import upstream
+from upstream_scheduler import chat_tokens, scheduler
+from audio_segments import OVERLAP_SECONDS, SEGMENT_SECONDS, Segment, split_audio, stitch
+from response_cache import ResponseCache
+from ttl_cache import TTLCache
+
+if TYPE_CHECKING:
+    from groq import AsyncGroq, Groq
 load_dotenv()
 
 
+# Seconds allowed for one Groq call before giving up
+TRANSCRIPTION_TIMEOUT = 120.0
+SUGGESTIONS_TIMEOUT = 60.0
+
+# Long recordings are split into segments (see audio_segments.py); this many are transcribed at once
+SEGMENT_CONCURRENCY = 4
+
+# Transcriptions keyed by the SHA-256 of the audio, so a re-uploaded recording is not transcribed twice
+transcription_cache = ResponseCache("transcription", maxsize=512, ttl=7 * 24 * 3600)
+
+# Job suggestions keyed by the normalised profile, dataset version and prompt (see suggestions_cache_key)
+suggestions_cache = ResponseCache("job_suggestions", maxsize=1024, ttl=24 * 3600)
+# Bump when the user prompt or the job market shortlist changes; the system prompt and
+# model parameters are part of the key already
+SUGGESTIONS_PROMPT_VERSION = "1"
+
+
 class GroqServices:
-    def __init__(self):
-        self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+    def __init__(self, client: Optional["Groq"] = None, async_client: Optional["AsyncGroq"] = None):
+        # Shared, keep-alive pooled clients by default (see clients.py)
+        self.client = client or upstream.groq
+        self.async_client = async_client or upstream.async_groq
+
+    # Every call waits for the model's Groq budget and is retried on 429 (see upstream_scheduler.py).
+    # Whisper is limited by requests per minute only, so transcriptions reserve no tokens.
+    def _translate(self, request):
+        return scheduler.run_sync("groq", request["model"], lambda: self.client.audio.translations.create(**request))
 
-    def speech_to_text(self, filename):
-        with open(filename, 'rb') as file:
-            file_content = file.read()
+    async def _atranslate(self, request):
+        return await scheduler.run("groq", request["model"], lambda: self.async_client.audio.translations.create(**request))
 
-            translation = self.client.audio.translations.create(
-                file=(filename, file_content),  # Required audio file
-                model="whisper-large-v3", 
-                prompt="Transcribe the following audio into text", 
-                response_format="json",  
-                temperature=0.0  
-            )
+    def _complete(self, request):
+        return scheduler.run_sync(
+            "groq", request["model"], lambda: self.client.chat.completions.create(**request), tokens=chat_tokens(request)
+        )
+
+    async def _acomplete(self, request):
+        return await scheduler.run(
+            "groq", request["model"], lambda: self.async_client.chat.completions.create(**request), tokens=chat_tokens(request)
+        )
+
+    def _transcription_request(self, filename, file_content):
+        return dict(
+            file=(filename, file_content),  # Required audio file: bytes or a file object streamed as is
+            model="whisper-large-v3", 
+            prompt="Transcribe the following audio into text", 
+            response_format="json",  
+            temperature=0.0,
+            timeout=TRANSCRIPTION_TIMEOUT
+        )
 
+    def speech_to_text(self, filename, file=None):
+        file_content = file if file is not None else _read_file(filename)
+        translation = self._translate(self._transcription_request(filename, file_content))
         return translation.text
 
+    def transcription_cache_key(self, digest: str) -> str:
+        """Cache key for audio with this SHA-256: the result also depends on the model, prompt and segmentation."""
+        request = self._transcription_request("", b"")
+        return transcription_cache.key(
+            digest,
+            request["model"],
+            request["prompt"],
+            request["response_format"],
+            str(request["temperature"]),
+            f"{SEGMENT_SECONDS}/{OVERLAP_SECONDS}",
+        )
+
+    async def aspeech_to_text(self, filename, file=None, digest: Optional[str] = None, release: Optional[Callable[[], None]] = None):
+        """Transcribe `filename`, or the already-open `file` (e.g. a spooled upload) under that name.
+
+        With the audio's SHA-256 `digest`, repeat uploads are answered from the transcription
+        cache and concurrent identical uploads share one transcription. `release` closes `file`
+        once nothing reads it: a shared transcription outlives a caller that disconnects.
+        """
+        if file is None:
+            file_content = await asyncio.to_thread(_read_file, filename)
+            translation = await self._atranslate(self._transcription_request(filename, file_content))
+            return translation.text
+
+        async def transcribe():
+            transcription = ""
+            async for update in self._transcribe_segments(filename, file):
+                if "error" in update:
+                    raise update["error"]
+                transcription = update["transcription"]
+            return transcription
+
+        if digest is None:
+            try:
+                return await transcribe()
+            finally:
+                if release is not None:
+                    release()
+        return await transcription_cache.fetch(self.transcription_cache_key(digest), transcribe, release=release)
+
+    async def astream_transcription(self, filename, file, digest: Optional[str] = None) -> AsyncGenerator[Dict[str, Any], None]:
+        """Transcribe overlapping segments of `file` concurrently and yield them in order.
+
+        Each update carries the segment, its new text (overlap with the previous segment
+        removed) and the transcription so far, or the segment and the exception if it failed.
+        A cached transcription for `digest` is yielded as a single update marked `cached`.
+        """
+        key = self.transcription_cache_key(digest) if digest else None
+        if key:
+            cached = await transcription_cache.aget(key)
+            if cached is not None:
+                yield {"segment": Segment(0, 0.0, None, filename, lambda: file), "text": cached, "transcription": cached, "cached": True}
+                return
+
+        started = time.perf_counter()
+        transcription = ""
+        failed = False
+        async for update in self._transcribe_segments(filename, file):
+            if "error" in update:
+                failed = True
+            else:
+                transcription = update["transcription"]
+            yield update
+
+        # Only complete transcriptions are worth replaying
+        if key and not failed and transcription:
+            transcription_cache.record_fetch(started)
+            await transcription_cache.aset(key, transcription)
+
+    async def _transcribe_segments(self, filename, file) -> AsyncGenerator[Dict[str, Any], None]:
+        segments = await asyncio.to_thread(split_audio, file, filename)
+        semaphore = asyncio.Semaphore(SEGMENT_CONCURRENCY)
+
+        async def transcribe(segment):
+            async with semaphore:
+                # Loaded only once a slot is free, so at most SEGMENT_CONCURRENCY segments are in memory
+                audio = await asyncio.to_thread(segment.load)
+                translation = await self._atranslate(self._transcription_request(segment.filename, audio))
+                return translation.text
+
+        tasks = [asyncio.create_task(transcribe(segment)) for segment in segments]
+        try:
+            transcription = ""
+            for segment, task in zip(segments, tasks):
+                try:
+                    text = await task
+                except Exception as e:
+                    yield {"segment": segment, "error": e}
+                    continue
+                text = stitch(transcription, text) if transcription else text.strip()
+                if text:
+                    transcription = f"{transcription} {text}" if transcription else text
+                yield {"segment": segment, "text": text, "transcription": transcription}
+        finally:
+            # The client went away or a caller stopped early: don't keep paying for the rest
+            for task in tasks:
+                task.cancel()
+
     def generate_job_suggestions(self, user_profile: UserProfile):
-        job_market_data_path = f"{os.getcwd()}/datasets/yr-earnings-occupation.json"
-        job_market_data = self.load_job_market_data(job_market_data_path)
+        request = self._suggestions_request(user_profile)
+        return suggestions_cache.fetch_sync(
+            suggestions_cache_key(user_profile, request),
+            lambda: self._complete(request).choices[0].message.content
+        )
+
+    async def agenerate_job_suggestions(self, user_profile: UserProfile):
+        request = self._suggestions_request(user_profile)
+
+        async def fetch():
+            completion = await self._acomplete(request)
+            return completion.choices[0].message.content
+
+        return await suggestions_cache.fetch(suggestions_cache_key(user_profile, request), fetch)
+
+    async def astream_job_suggestions(self, user_profile: UserProfile) -> AsyncGenerator[Dict[str, Any], None]:
+        """Stream the analysis as {"content": ...} chunks, with a {"section": ...} update before each section heading.
+
+        A cached analysis for the same profile is replayed at once, followed by {"cached": True}.
+        """
+        request = self._suggestions_request(user_profile)
+        key = suggestions_cache_key(user_profile, request)
+        sections = SectionSplitter()
+
+        cached = await suggestions_cache.aget(key)
+        if cached is not None:
+            for update in sections.feed(cached) + sections.close():
+                yield update
+            yield {"cached": True}
+            return
+
+        started = time.perf_counter()
+        parts = []
+        # Only opening the stream is rate limited and retried; a 429 arrives before the first chunk
+        stream = await self._acomplete({**request, "stream": True})
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                for update in sections.feed(chunk.choices[0].delta.content):
+                    yield update
+        for update in sections.close():
+            yield update
+
+        if parts:
+            suggestions_cache.record_fetch(started)
+            await suggestions_cache.aset(key, "".join(parts))
+
+    def _suggestions_request(self, user_profile: UserProfile):
+        current, shortlist = shortlist_job_market(user_profile)
+        current_line = (
+            f"Closest match to their current role: {current.description} - £{current.median:,.0f}"
+            if current else "Closest match to their current role: unknown"
+        )
         user_prompt = f"""
                     User career profile data: {user_profile}.
-                    Job market data {job_market_data}.
+                    {current_line}
+                    Job market data:
+                    {format_job_market(shortlist)}
                     """
         system_prompt = """
         You are a career advisor assistant. You will be given two types of information:
@@ -58,14 +260,8 @@ class GroqServices:
             "location": "current location"
         }
 
-        2. Job Market Data:
-        [
-            {
-                "description": "Job title/description",
-                "code": "Job classification code",
-                "median": Median salary as float
-            }
-        ]
+        2. Job Market Data (occupations shortlisted for this profile, UK median annual pay):
+        - Job title/description: £median salary
 
         Your task is to:
 
@@ -146,7 +342,7 @@ class GroqServices:
         - Align recommendations with demonstrated progression rate
         """
 
-        completion = self.client.chat.completions.create(
+        return dict(
             model="llama-3.1-70b-versatile",
             messages=[
                 {
@@ -162,21 +358,169 @@ class GroqServices:
             max_tokens=3500,
             top_p=0.95,
             stream=False,
-            stop=None
+            stop=None,
+            timeout=SUGGESTIONS_TIMEOUT
         )
 
-        # Collect the streaming response into a single string
-        return completion.choices[0].message.content
 
+class SectionSplitter:
+    """Finds the section headings of the suggestions format in a token stream.
+
+    Text is passed through as soon as it arrives, except at the start of a line that may
+    still turn out to be a heading ("Career Analysis:", "Top Recommendations:" or a numbered
+    recommendation), which is held until the line is complete.
+    """
+
+    HEADINGS = ("Career Analysis", "Top Recommendations")
+    RECOMMENDATION = re.compile(r"(\d{1,2})\.\s+(.+)")
+    MAX_HEADING_LENGTH = 160
+
+    def __init__(self):
+        self.line = ""
+        self.at_line_start = True
+        self.in_recommendations = False
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        updates: List[Dict[str, Any]] = []
+        passthrough = []
+        for char in text:
+            if not self.at_line_start:
+                passthrough.append(char)
+                if char == "\n":
+                    self.at_line_start = True
+                continue
+
+            self.line += char
+            if char == "\n" or not self._may_be_heading(self.line):
+                if passthrough:
+                    updates.append({"content": "".join(passthrough)})
+                    passthrough = []
+                updates.extend(self._flush_line(complete=char == "\n"))
+        if passthrough:
+            updates.append({"content": "".join(passthrough)})
+        return updates
+
+    def close(self) -> List[Dict[str, Any]]:
+        return self._flush_line(complete=True) if self.line else []
+
+    def _flush_line(self, complete: bool) -> List[Dict[str, Any]]:
+        line, self.line = self.line, ""
+        self.at_line_start = complete
+        section = self._heading(line) if complete else None
+        return ([section] if section else []) + [{"content": line}]
 
     @staticmethod
-    def load_job_market_data(file_path):
-        try:
-            with open(file_path, 'r') as file:
-                job_data = json.load(file)
-            return job_data
-
-        except FileNotFoundError:
-            raise FileNotFoundError(f"Job market data file not found at: {file_path}")
-        except json.JSONDecodeError:
-            raise ValueError(f"Invalid JSON format in file: {file_path}")
\ No newline at end of file
+    def _plain(line: str) -> str:
+        return line.strip().strip("#*").strip()
+
+    def _may_be_heading(self, partial: str) -> bool:
+        if len(partial) > self.MAX_HEADING_LENGTH:
+            return False
+        plain = self._plain(partial)
+        if not plain:
+            return True
+        if any(heading.startswith(plain) or plain.startswith(heading) for heading in self.HEADINGS):
+            return True
+        return self.in_recommendations and bool(re.match(r"\d{1,2}(\.|$)", plain))
+
+    def _heading(self, line: str) -> Optional[Dict[str, Any]]:
+        plain = self._plain(line)
+        for heading in self.HEADINGS:
+            if plain.startswith(heading):
+                self.in_recommendations = heading == "Top Recommendations"
+                return {"section": heading}
+        match = self.RECOMMENDATION.match(plain) if self.in_recommendations else None
+        if match:
+            return {"section": f"Recommendation {match.group(1)}", "title": match.group(2).replace("*", "").strip()}
+        return None
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    return value
+
+
+def profile_fingerprint(user_profile: UserProfile) -> str:
+    """SHA-256 of the profile with whitespace collapsed and its unordered lists (skills, education) sorted.
+
+    Jobs keep their order: it tells the model which role came first.
+    """
+    profile = _normalize(user_profile.model_dump())
+    profile["skills"] = sorted({skill.casefold() for skill in profile["skills"] if skill})
+    profile["education"] = sorted(profile["education"], key=lambda entry: json.dumps(entry, sort_keys=True))
+    return hashlib.sha256(json.dumps(profile, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def suggestions_cache_key(user_profile: UserProfile, request) -> str:
+    """Profile fingerprint + dataset version + prompt, so a dataset reload or prompt edit misses the old entries."""
+    return suggestions_cache.key(
+        profile_fingerprint(user_profile),
+        registry.current().version,
+        SUGGESTIONS_PROMPT_VERSION,
+        request["messages"][0]["content"],
+        json.dumps({name: request[name] for name in ("model", "temperature", "max_tokens", "top_p")}, sort_keys=True),
+    )
+
+
+def _read_file(filename) -> bytes:
+    with open(filename, 'rb') as file:
+        return file.read()
+
+
+def shortlist_cache() -> TTLCache:
+    """Shortlists memoised for the current dataset version; a reload starts a fresh one."""
+    return registry.current().derived("job_market_shortlists", lambda snapshot: TTLCache(maxsize=4096, ttl=None))
+
+
+def shortlist_job_market(user_profile: UserProfile, limit: int = 25):
+    """Pick the occupations worth showing the model for this profile.
+
+    Returns the closest occupation to the user's current role (or None) and up to
+    `limit` occupations paying more than it, most relevant to their roles and skills first.
+    Profiles with the same current role, titles and skills share one computation.
+    """
+    # Current band: the job marked "Present", else the first one listed
+    current_jobs = [job for job in user_profile.jobs if job.dates.end.strip().lower() == "present"]
+    current_job = (current_jobs or user_profile.jobs or [None])[0]
+    current_title = current_job.title if current_job else None
+
+    titles = " ".join(job.title for job in user_profile.jobs)
+    query = f"{titles} {titles} {' '.join(user_profile.skills)} {user_profile.wanted_skills}"
+
+    memo = shortlist_cache()
+    key = (" ".join(current_title.lower().split()) if current_title else None, " ".join(query.lower().split()), limit)
+    shortlist = memo.get(key)
+    if shortlist is None:
+        shortlist = _shortlist(current_title, query, limit)
+        memo.set(key, shortlist)
+    return shortlist
+
+
+def _shortlist(current_title: Optional[str], query: str, limit: int):
+    index = registry.current().occupation_index
+    current = index.lookup(current_title) if current_title else None
+    floor = current.median if current else 0.0
+
+    relevance = index.scores(query)
+
+    above_band = np.nan_to_num(index.medians) > floor
+    relevant = above_band & (relevance > 0)
+    rows = np.flatnonzero(relevant)
+    rows = rows[np.lexsort((-index.medians[rows], -relevance[rows]))][:limit]
+
+    if len(rows) < limit:
+        # Top up with the nearest better-paid occupations: the most reachable next steps
+        rest = np.flatnonzero(above_band & ~relevant)
+        rest = rest[np.argsort(index.medians[rest])][:limit - len(rows)]
+        rows = np.concatenate([rows, rest])
+
+    return current, [index.occupations[row] for row in rows]
+
+
+def format_job_market(occupations: List[Occupation]) -> str:
+    return "\n".join(f"- {occupation.description}: £{occupation.median:,.0f}" for occupation in occupations)
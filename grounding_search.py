@@ -1,15 +1,28 @@
 # Grounding search using Perplexity's API
-import os
-from openai import OpenAI
+from typing import TYPE_CHECKING, Optional
 from dotenv import load_dotenv
+from clients import upstream
+from upstream_scheduler import chat_tokens, scheduler
+from response_cache import ResponseCache
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
 
 load_dotenv()
 
+# Seconds allowed for one Perplexity call before giving up
+REQUEST_TIMEOUT = 30.0
+
+# Temperature 0 answers for the same query; facts change, so entries live for 6 hours
+search_cache = ResponseCache("grounding_search", maxsize=2048, ttl=6 * 3600)
+
 class PerplexityGenericSearch:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("PERPLEXITY_API_KEY"), base_url="https://api.perplexity.ai")
+    def __init__(self, client: Optional["OpenAI"] = None, async_client: Optional["AsyncOpenAI"] = None):
+        # Shared, keep-alive pooled clients by default (see clients.py)
+        self.client = client or upstream.perplexity
+        self.async_client = async_client or upstream.async_perplexity
 
-    def search(self, query: str):
+    def _request(self, query: str):
         messages = [
             {
                 "role": "system",
@@ -27,13 +40,47 @@ class PerplexityGenericSearch:
             },
         ]
 
-        response = self.client.chat.completions.create(
+        return dict(
             model="llama-3.1-sonar-large-128k-online",
             messages=messages,
             temperature=0,  # Set to 0 for maximum factuality
             presence_penalty=1,  # Removed penalties to focus on direct answers
         
-            stream=False
+            stream=False,
+            timeout=REQUEST_TIMEOUT
         )
-        
-        return response.choices[0].message.content 
\ No newline at end of file
+
+    def _complete(self, request):
+        return scheduler.run_sync(
+            "perplexity",
+            request["model"],
+            lambda: self.client.chat.completions.create(**request),
+            tokens=chat_tokens(request),
+        )
+
+    async def _acomplete(self, request):
+        return await scheduler.run(
+            "perplexity",
+            request["model"],
+            lambda: self.async_client.chat.completions.create(**request),
+            tokens=chat_tokens(request),
+        )
+
+    def _cache_key(self, query: str, request) -> str:
+        return search_cache.key(query, request["model"], request["messages"][0]["content"])
+
+    def search(self, query: str):
+        request = self._request(query)
+        return search_cache.fetch_sync(
+            self._cache_key(query, request),
+            lambda: self._complete(request).choices[0].message.content
+        )
+
+    async def asearch(self, query: str):
+        request = self._request(query)
+
+        async def fetch():
+            response = await self._acomplete(request)
+            return response.choices[0].message.content
+
+        return await search_cache.fetch(self._cache_key(query, request), fetch)
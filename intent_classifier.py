@@ -0,0 +1,242 @@
+# In-process intent classifier that answers the router's question locally when it can.
+# Keyword rules catch the unambiguous openers, a small TF-IDF nearest-centroid model
+# covers the rest, and anything below the confidence bar is left to the router LLM.
+import math
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Labels are the router prompt's vocabulary, so a local decision is exactly the word
+# the router LLM would have answered with.
+TRAINING_EXAMPLES: Dict[str, List[str]] = {
+    "general": [
+        "hi",
+        "hello there",
+        "hey, how are you",
+        "thanks for your help",
+        "thank you",
+        "good morning",
+        "who are you",
+        "what can you do",
+        "tell me a joke",
+        "what is the weather like today",
+        "I can work anywhere in the UK and my main goal is a better work life balance",
+        "I have no time constraints",
+        "my motivation is earning more money for my family",
+        "general question",
+    ],
+    "career": [
+        "I want to change my career",
+        "what career should I pursue",
+        "how do I progress in my career",
+        "I feel stuck in my job and want to move up",
+        "how can I get promoted to manager",
+        "I'm an assembly line supervisor, what are my career options",
+        "should I switch industries",
+        "career advice for a warehouse operative",
+        "how do I become a team leader",
+        "what jobs pay more than my current role",
+        "I want a career change into tech",
+        "professional development plan",
+    ],
+    "resume": [
+        "can you review my CV",
+        "help me write my CV",
+        "improve my resume",
+        "write a cover letter for this job",
+        "how should I format my CV",
+        "is my CV ATS friendly",
+        "what should I put on my resume",
+        "my cover letter needs work",
+        "how long should a CV be in the UK",
+        "rewrite my personal statement on my CV",
+    ],
+    "interview": [
+        "help me prepare for an interview",
+        "what questions will they ask in my interview",
+        "mock interview practice",
+        "how do I answer tell me about yourself",
+        "I have a job interview tomorrow",
+        "how to answer strengths and weaknesses interview question",
+        "STAR method interview answers",
+        "what to wear to an interview",
+        "how do I follow up after an interview",
+        "competency based interview questions",
+    ],
+    "skills": [
+        "what skills do I need to become a data analyst",
+        "skill gap analysis for project management",
+        "which courses should I take",
+        "how can I learn python",
+        "recommend training to upskill",
+        "what certifications should I get",
+        "I want to learn new skills",
+        "best online courses for electricians",
+        "how do I improve my excel skills",
+        "what qualifications do I need",
+    ],
+    "networking": [
+        "how do I network in my industry",
+        "improve my LinkedIn profile",
+        "how do I reach out to recruiters",
+        "write a message to connect with someone on LinkedIn",
+        "networking events near me",
+        "how to ask for a referral",
+        "how to build professional connections",
+        "find a mentor in my field",
+        "outreach template for a hiring manager",
+        "how do I get introduced to people at a company",
+    ],
+    "job_search": [
+        "help me find a job",
+        "where can I find jobs near me",
+        "which job boards should I use",
+        "how do I apply for jobs",
+        "I'm unemployed and looking for work",
+        "job search strategy",
+        "how to track my job applications",
+        "find me vacancies in Manchester",
+        "I have been applying for months with no luck",
+        "best websites to search for jobs in the UK",
+    ],
+    "research": [
+        "research the UK construction industry outlook",
+        "give me a detailed analysis of the renewable energy sector",
+        "what does academic research say about remote work productivity",
+        "comprehensive overview of apprenticeship schemes in the UK",
+        "compare the labour market trends in the north and south",
+        "in depth report on AI impact on jobs",
+        "detailed research on nursing shortages in the NHS",
+        "analyse the growth of green jobs",
+    ],
+}
+
+# High-precision patterns. A rule only decides the route when every matching rule
+# agrees on the label; conflicting matches fall through to the model.
+KEYWORD_RULES: List[Tuple[str, str]] = [
+    (r"^(hi|hello|hey|thanks|thank you|good (morning|afternoon|evening))\b[\s!.,]*$", "general"),
+    (r"\b(cv|cvs|resume|résumé|cover letter|personal statement)\b", "resume"),
+    (r"\b(interview|interviews|interviewing|interviewer)\b", "interview"),
+    (r"\b(linkedin|networking|referral|recruiters?|mentor)\b", "networking"),
+    (r"\b(job boards?|job search|job hunt(ing)?|vacanc(y|ies)|job applications?)\b", "job_search"),
+    (r"\b(upskill(ing)?|skill gaps?|certifications?|courses?)\b", "skills"),
+]
+
+STOPWORDS = frozenset(
+    "a an the and or of to in on for with my me i i'm im is are be can do you your it "
+    "this that at as how what which should".split()
+)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def _features(text: str) -> List[str]:
+    tokens = [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+class IntentClassifier:
+    def __init__(
+        self,
+        examples: Dict[str, List[str]] = TRAINING_EXAMPLES,
+        rules: List[Tuple[str, str]] = KEYWORD_RULES,
+        min_score: float = 0.25,
+        min_margin: float = 0.1,
+    ):
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.rules = [(re.compile(pattern, re.IGNORECASE), label) for pattern, label in rules]
+        self.labels = list(examples)
+
+        # Vocabulary and smoothed IDF over every labelled example
+        documents = [(label, _features(text)) for label, texts in examples.items() for text in texts]
+        self.vocabulary: Dict[str, int] = {}
+        document_frequency: Counter = Counter()
+        for _, features in documents:
+            for feature in set(features):
+                self.vocabulary.setdefault(feature, len(self.vocabulary))
+                document_frequency[feature] += 1
+
+        self.idf = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for feature, index in self.vocabulary.items():
+            self.idf[index] = math.log((1 + len(documents)) / (1 + document_frequency[feature])) + 1
+
+        # One L2-normalised centroid per label; scoring a message is a single gather + dot
+        self.centroids = np.zeros((len(self.labels), len(self.vocabulary)), dtype=np.float32)
+        for label, features in documents:
+            indices, weights = self._vectorize(features)
+            self.centroids[self.labels.index(label), indices] += weights
+        self.centroids /= np.linalg.norm(self.centroids, axis=1, keepdims=True)
+
+        # Metrics
+        self.rule_hits = 0
+        self.model_hits = 0
+        self.deferred = 0
+        self.classify_seconds = 0.0
+        self.router_calls = 0
+        self.router_seconds = 0.0
+
+    def _vectorize(self, features: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        counts = Counter(f for f in features if f in self.vocabulary)
+        indices = np.fromiter((self.vocabulary[f] for f in counts), dtype=np.intp, count=len(counts))
+        weights = np.fromiter((1 + math.log(c) for c in counts.values()), dtype=np.float32, count=len(counts))
+        weights *= self.idf[indices]
+        norm = np.linalg.norm(weights)
+        if norm:
+            weights /= norm
+        return indices, weights
+
+    def scores(self, message: str) -> Dict[str, float]:
+        indices, weights = self._vectorize(_features(message))
+        return dict(zip(self.labels, (self.centroids[:, indices] @ weights).tolist()))
+
+    def _decide(self, message: str) -> Tuple[Optional[str], str]:
+        matched = {label for pattern, label in self.rules if pattern.search(message)}
+        if len(matched) == 1:
+            return matched.pop(), "rule"
+
+        indices, weights = self._vectorize(_features(message))
+        if not len(indices):
+            return None, "deferred"
+        similarities = self.centroids[:, indices] @ weights
+        top, runner_up = np.argsort(similarities)[::-1][:2]
+        if similarities[top] >= self.min_score and similarities[top] - similarities[runner_up] >= self.min_margin:
+            return self.labels[top], "model"
+        return None, "deferred"
+
+    def classify(self, message: str) -> Optional[str]:
+        """Return the router label for a confident local decision, or None to defer to the router LLM."""
+        started = time.perf_counter()
+        label, source = self._decide(message)
+        self.classify_seconds += time.perf_counter() - started
+
+        if source == "rule":
+            self.rule_hits += 1
+        elif source == "model":
+            self.model_hits += 1
+        else:
+            self.deferred += 1
+        return label
+
+    def record_router_call(self, seconds: float) -> None:
+        """Record the latency of a router LLM call, used to estimate the time saved by local hits."""
+        self.router_calls += 1
+        self.router_seconds += seconds
+
+    def stats(self) -> Dict[str, float]:
+        hits = self.rule_hits + self.model_hits
+        total = hits + self.deferred
+        router_avg_ms = (self.router_seconds / self.router_calls) * 1000 if self.router_calls else None
+        return {
+            "requests": total,
+            "rule_hits": self.rule_hits,
+            "model_hits": self.model_hits,
+            "deferred": self.deferred,
+            "hit_rate": hits / total if total else 0.0,
+            "avg_classify_us": (self.classify_seconds / total) * 1e6 if total else 0.0,
+            "avg_router_ms": router_avg_ms,
+            "estimated_saved_ms": hits * router_avg_ms if router_avg_ms is not None else None,
+        }
@@ -3,26 +3,15 @@ import json
 from pathlib import Path
 from dotenv import load_dotenv
 from groq import Groq
+from transitions import transition_engine
 
-def load_json_data(file_path):
-    with open(file_path, 'r') as f:
-        return json.load(f)
-
-def get_potential_transitions(current_salary, occupations, threshold=1.2):
-    potential_jobs = []
-    
-    for occupation in occupations:
-        if occupation['median'] > current_salary * threshold:
-            salary_increase = occupation['median'] - current_salary
-            increase_percentage = (salary_increase / current_salary) * 100
-            potential_jobs.append({
-                'title': occupation['description'],
-                'salary': occupation['median'],
-                'increase': salary_increase,
-                'percentage': increase_percentage
-            })
-    
-    return sorted(potential_jobs, key=lambda x: x['salary'], reverse=True)
+def get_potential_transitions(current_salary, region=None, threshold=1.2, limit=10):
+    return transition_engine().rank(
+        current_salary=current_salary,
+        region=region,
+        threshold=threshold,
+        limit=limit,
+    )['transitions']
 
 def get_career_advice(current_job, current_salary, potential_jobs):
     client = Groq(api_key=os.getenv('GROQ_API'))
@@ -61,17 +50,15 @@ Please be concise but specific in your recommendations."""
 def main():
     load_dotenv()
     
-    # Load occupation data
-    occupations_data = load_json_data('datasets/json/yr-earnings-occupation.json')
-    
     # Get user input
     print("Career Transition Advisor")
     print("------------------------")
     current_job = input("Enter your current job title: ")
     current_salary = float(input("Enter your current annual salary: "))
+    region = input("Enter your region or town (optional): ") or None
     
     # Get potential transitions directly using salary
-    potential_jobs = get_potential_transitions(current_salary, occupations_data['occupations'])
+    potential_jobs = get_potential_transitions(current_salary, region)
     
     if not potential_jobs:
         print("\nNo potential transitions found that meet the salary increase criteria.")
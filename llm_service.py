@@ -1,15 +1,25 @@
+import asyncio
 import os
+import re
+import time
 from typing import AsyncGenerator, Dict, Any, Annotated
+from collections import Counter
 from enum import Enum
-from pydantic import BaseModel
 from fastapi import HTTPException
 from langchain_groq import ChatGroq
 from langchain_core.messages import AIMessage, HumanMessage, AIMessageChunk
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_community.chat_models import ChatPerplexity
 from langgraph.graph import StateGraph, END, START
-from typing import TypedDict, Sequence, Union, cast
+from typing import TypedDict, Sequence, Union, Optional, cast
 from langgraph.graph.message import add_messages
+from intent_classifier import IntentClassifier
+from ttl_cache import TTLCache
+from session_store import SessionStore, estimate_tokens
+from context_window import ContextWindowManager
+from occupation_index import format_occupations
+from dataset_registry import registry
+from clients import upstream
+from agent_registry import AgentRegistry, AgentSpec, CompiledAgent
+from upstream_scheduler import UpstreamBusy, scheduler
 
 class AgentType(str, Enum):
     SALARY = "salary"
@@ -22,42 +32,17 @@ class AgentType(str, Enum):
     JOB_SEARCH = "research"
     RESEARCH = "job_search"
 
-class ChatRequest(BaseModel):
-    message: str
-
 class ChatState(TypedDict):
     messages: Annotated[list, add_messages]
     agent_type: str
-    history: list
-
-class LLMService:
-    def __init__(self):
-        print("Initializing LLM Service")  # Debug
-        
-        # Add the salary data to the system first
-        with open('datasets/yr-earnings-occupation.yaml', 'r') as file:
-            self.salary_data = file.read()
-            
-        # Initialize LLM configurations with streaming enabled
-        self.router_llm = ChatGroq(
-            groq_api_key=os.getenv('GROQ_API'),
-            model_name="llama-3.1-8b-instant",
-            temperature=0,
-            max_tokens=256,
-            streaming=True
-        )
-        
-        self.agent_llm = ChatGroq(
-            groq_api_key=os.getenv('GROQ_API'),
-            model_name="llama-3.1-70b-versatile",
-            temperature=0,
-            max_tokens=1024,
-            streaming=True
-        )
-        
-        # Initialize prompts
-        self.router_prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an intelligent router that determines which specialized agent should handle user requests.
+    session_id: str
+
+# Router and agent prompts, compiled into chains on first use (see agent_registry.py).
+# `salary_data` is filled in per request with the occupations relevant to the message.
+AGENT_SPECS = [
+    AgentSpec(
+        "router",
+        system="""You are an intelligent router that determines which specialized agent should handle user requests.
             - Use 'career' for general career advice and professional development
             - Use 'resume' for resume and cover letter optimization
             - Use 'interview' for interview preparation and practice
@@ -67,13 +52,13 @@ class LLMService:
             - Use 'research' for queries requiring detailed research, academic topics, or comprehensive analysis
             - Use 'general' for all other topics and general conversation and the first conversation, if the user mentions general use this agent.
             
-            Respond with only one word from the options above."""),
-            ("human", "{message}")
-        ])
-        
-        self.agent_prompts = {
-        AgentType.CAREER: ChatPromptTemplate.from_messages([
-            ("system", f"""You are a career advisor assistant called Veridian. You will be given two types of information:
+            Respond with only one word from the options above.""",
+        history=False,
+        llm="router",
+    ),
+    AgentSpec(
+        AgentType.CAREER,
+        system="""You are a career advisor assistant called Veridian. You will be given two types of information:
         ## 1. Personal Career Profile:
         ## Personal Career Profile:
         
@@ -101,7 +86,7 @@ class LLMService:
         - current location
 
         2. Job Market Data:
-        {self.salary_data}
+        {salary_data}
 
         Your task is to:
 
@@ -180,12 +165,11 @@ class LLMService:
         - Consider proximity of recommended roles to current location
         - Balance formal education with practical experience
         - Align recommendations with demonstrated progression rate
-        """),
-            MessagesPlaceholder(variable_name="messages"),
-            ("human", "{message}")
-        ]),
-        AgentType.GENERAL: ChatPromptTemplate.from_messages([
-            ("system", """You are a UK-focused assistant called Veridian.
+        """,
+    ),
+    AgentSpec(
+        AgentType.GENERAL,
+        system="""You are a UK-focused assistant called Veridian.
             Keep responses concise and well-structured with:
             • Clear bullet points for key points
             • Short paragraphs (2-3 sentences max)
@@ -203,12 +187,11 @@ class LLMService:
              
             You will fill in the blanks using your reasoning and the information provided. Do not keep asking the same questions over and over.
             
-            """),
-            MessagesPlaceholder(variable_name="messages"),
-            ("human", "{message}")
-        ]),
-        AgentType.RESUME: ChatPromptTemplate.from_messages([
-            ("system", """You are an expert in UK CV and cover letter optimisation.
+            """,
+    ),
+    AgentSpec(
+        AgentType.RESUME,
+        system="""You are an expert in UK CV and cover letter optimisation.
             Keep responses concise and well-structured with:
             • Clear bullet points for suggestions
             • Short paragraphs (2-3 sentences max)
@@ -218,12 +201,11 @@ class LLMService:
             Provide:
             • 3-4 key improvements maximum
             • Specific examples
-            • ATS-friendly formatting tips"""),
-            MessagesPlaceholder(variable_name="messages"),
-            ("human", "{message}")
-        ]),
-        AgentType.INTERVIEW: ChatPromptTemplate.from_messages([
-            ("system", """You are an interview preparation expert for the UK job market.
+            • ATS-friendly formatting tips""",
+    ),
+    AgentSpec(
+        AgentType.INTERVIEW,
+        system="""You are an interview preparation expert for the UK job market.
             Keep responses concise and well-structured with:
             • Clear bullet points for questions/answers
             • Short paragraphs (2-3 sentences max)
@@ -233,12 +215,11 @@ class LLMService:
             Focus on:
             • 3-4 key interview questions
             • Brief, structured answers
-            • 2-3 specific improvement tips"""),
-            MessagesPlaceholder(variable_name="messages"),
-            ("human", "{message}")
-        ]),
-        AgentType.SKILLS: ChatPromptTemplate.from_messages([
-            ("system", """You are a UK skill development advisor.
+            • 2-3 specific improvement tips""",
+    ),
+    AgentSpec(
+        AgentType.SKILLS,
+        system="""You are a UK skill development advisor.
             Keep responses concise and well-structured with:
             • Clear bullet points for recommendations
             • Short paragraphs (2-3 sentences max)
@@ -248,12 +229,11 @@ class LLMService:
             Provide:
             • 2-3 key skill gaps identified
             • Specific UK course recommendations
-            • 2-3 practical exercises"""),
-            MessagesPlaceholder(variable_name="messages"),
-            ("human", "{message}")
-        ]),
-        AgentType.NETWORKING: ChatPromptTemplate.from_messages([
-            ("system", """You are a UK professional networking advisor.
+            • 2-3 practical exercises""",
+    ),
+    AgentSpec(
+        AgentType.NETWORKING,
+        system="""You are a UK professional networking advisor.
             Keep responses concise and well-structured with:
             • Clear bullet points for strategies
             • Short paragraphs (2-3 sentences max)
@@ -263,12 +243,11 @@ class LLMService:
             Focus on:
             • 2-3 networking tactics
             • Brief LinkedIn optimization tips
-            • 1-2 outreach templates"""),
-            MessagesPlaceholder(variable_name="messages"),
-            ("human", "{message}")
-        ]),
-        AgentType.JOB_SEARCH: ChatPromptTemplate.from_messages([
-            ("system", """You are a UK job search expert.
+            • 1-2 outreach templates""",
+    ),
+    AgentSpec(
+        AgentType.JOB_SEARCH,
+        system="""You are a UK job search expert.
             Keep responses concise and well-structured with:
             • Clear bullet points for strategies
             • Short paragraphs (2-3 sentences max)
@@ -280,31 +259,29 @@ class LLMService:
             • Brief application tips
             • Simple tracking method
              
-             you will tailor your response to the user's location and the job market in that area"""),
-            MessagesPlaceholder(variable_name="messages"),
-            ("human", "{message}")
-        ]),
-        AgentType.SALARY: ChatPromptTemplate.from_messages([
-            ("system", f"""You are a UK salary and career advisor with access to accurate occupational salary data.
-            Keep responses concise and well-structured with:
-            • Clear bullet points for salary information
-            • Short paragraphs (2-3 sentences max)
-            • Line breaks between sections
-            • Use markdown formatting
+             you will tailor your response to the user's location and the job market in that area""",
+    ),
+    AgentSpec(
+        AgentType.SALARY,
+        system="""You are a UK salary and career advisor with access to accurate occupational salary data.
+            Your responses should not include any markdown formatting.
             
-            Use this official UK salary data:
-            {self.salary_data}
+            Use this official UK salary data to inform your recommendations:
+            {salary_data}
+            
+            When making suggestions:
+            - Always reference accurate salary figures from the data
+            - Compare salaries across related roles
+            - Consider career progression paths and salary growth potential
+            - Highlight roles that match the user's skills and salary expectations
+            - Explain salary variations within industries
+            - Include median salaries for all roles you mention
             
-            Include:
-            • Median salaries as "£XX,XXX"
-            • 2-3 related roles with salaries
-            • Brief progression path
-            • Key salary factors"""),
-            MessagesPlaceholder(variable_name="messages"),
-            ("human", "{message}")
-        ]),
-        AgentType.RESEARCH: ChatPromptTemplate.from_messages([
-            ("system", """Here are some sources. Read these carefully to answer the user's questions.
+            Format salary mentions as "£XX,XXX" and always specify they are median figures.""",
+    ),
+    AgentSpec(
+        AgentType.RESEARCH,
+        system="""Here are some sources. Read these carefully to answer the user's questions.
 
 # General Instructions
 
@@ -329,9 +306,8 @@ Return links in a markdown format.
         Option 3: Upskill for a New Trade – Suggest a completely different but feasible career path (e.g., becoming an Automation Technician or Trade Specialist), including training programs that are easy to enter based on their manual labor experience.
 
 ALWAYS write in this language: english.
-"""),
-            MessagesPlaceholder(variable_name="messages"),
-            ("human", """ You are an AI agent specializing in creating practical and achievable career plans for users based on their unique experience and goals. Your goal is to provide realistic paths that consider their current job, skills, and constraints, emphasizing specific and tangible steps to reach a higher-level position. Use a structured approach that prioritizes clarity and feasibility. Follow these guidelines:
+""",
+        human=""" You are an AI agent specializing in creating practical and achievable career plans for users based on their unique experience and goals. Your goal is to provide realistic paths that consider their current job, skills, and constraints, emphasizing specific and tangible steps to reach a higher-level position. Use a structured approach that prioritizes clarity and feasibility. Follow these guidelines:
 
     Detailed Career Plan (Post-Selection):
         Once the user selects an option, outline the steps in a way that’s directly actionable:
@@ -351,67 +327,166 @@ ALWAYS write in this language: english.
 
 
 
-    Be clear, specific, and actionable. Avoid overwhelming the user with too many options or abstract suggestions. Focus on building a step-by-step plan that is feasible within their experience level and constraints.” {message}""")
-        ])
-    }
+    Be clear, specific, and actionable. Avoid overwhelming the user with too many options or abstract suggestions. Focus on building a step-by-step plan that is feasible within their experience level and constraints.” {message}""",
+    ),
+]
 
+
+class LLMService:
+    def __init__(self, speculative: Optional[bool] = None):
+        print("Initializing LLM Service")  # Debug
+        
+        self._build_models()
+        
+        # Chains are compiled on first use and reused across requests
+        self.agents = AgentRegistry({"router": self.router_llm, "agent": self.agent_llm}, AGENT_SPECS)
+        
+        # Local fast path in front of the router LLM
+        self.intent_classifier = IntentClassifier()
+        
+        # Router decisions keyed on normalised message text, dropped whenever the router spec changes
+        self.routing_cache = TTLCache(maxsize=2048, ttl=6 * 3600)
+        self._routing_cache_prompt = self._router_prompt_fingerprint()
         
         # Initialize the graph
         self.workflow = self._create_graph()
         
         # Add conversation history storage
-        self.conversation_history = {}  # Store history by user_id
-
-        # Add new salary-aware agent prompt
-        self.agent_prompts[AgentType.SALARY] = ChatPromptTemplate.from_messages([
-            ("system", f"""You are a UK salary and career advisor with access to accurate occupational salary data.
-            Your responses should not include any markdown formatting.
-            
-            Use this official UK salary data to inform your recommendations:
-            {self.salary_data}
-            
-            When making suggestions:
-            - Always reference accurate salary figures from the data
-            - Compare salaries across related roles
-            - Consider career progression paths and salary growth potential
-            - Highlight roles that match the user's skills and salary expectations
-            - Explain salary variations within industries
-            - Include median salaries for all roles you mention
-            
-            Format salary mentions as "£XX,XXX" and always specify they are median figures."""),
-            MessagesPlaceholder(variable_name="messages"),
-            ("human", "{message}")
-        ])
+        self.conversation_history = SessionStore()  # Store history by user_id
         
-        # Update router prompt to include salary routing
-      
-        
-        self.research_llm = ChatPerplexity(
+        # Agents see a token-budgeted window of the history; older turns are summarised by the small model
+        self.context_window = ContextWindowManager(
+            self.conversation_history,
+            self.summary_llm,
+            budgets={
+                # The data-heavy system prompts leave less room for history
+                AgentType.CAREER: 800,
+                AgentType.SALARY: 800,
+                AgentType.GENERAL: 1000,
+                AgentType.RESEARCH: 2000,
+            },
+            default_budget=1500
+        )
+
+        # Speculative mode: start the most likely agent while the router LLM is still deciding
+        if speculative is None:
+            speculative = os.getenv("SPECULATIVE_ROUTING", "").lower() in ("1", "true", "yes")
+        self.speculative = speculative
+        self.recent_agents = TTLCache(maxsize=10000, ttl=3600)  # Last routed agent by user_id
+        self.agent_prior = Counter()  # Routed agent frequencies, used when a user has no recent route
+        self.speculation_stats = {"attempts": 0, "hits": 0, "misses": 0, "head_start_tokens": 0, "wasted_tokens": 0}
+
+    def _build_models(self) -> None:
+        # The models are bound to the shared upstream pools as they are now
+        self._pools = (upstream.http, upstream.async_http)
+
+        # Initialize LLM configurations with streaming enabled. Retries are left to
+        # upstream_scheduler, which paces them against the Groq rate limits
+        self.router_llm = ChatGroq(
+            groq_api_key=os.getenv('GROQ_API'),
+            http_client=upstream.http,
+            http_async_client=upstream.async_http,
+            max_retries=0,
+            model_name="llama-3.1-8b-instant",
             temperature=0,
-            pplx_api_key=os.getenv('PERPLEXITY_API_KEY'),
-            model="llama-3-sonar-small-32k-online"
+            max_tokens=256,
+            streaming=True
         )
         
+        self.agent_llm = ChatGroq(
+            groq_api_key=os.getenv('GROQ_API'),
+            http_client=upstream.http,
+            http_async_client=upstream.async_http,
+            max_retries=0,
+            model_name="llama-3.1-70b-versatile",
+            temperature=0,
+            max_tokens=1024,
+            streaming=True
+        )
+
+        # Summarises older turns for the context window
+        self.summary_llm = ChatGroq(
+            groq_api_key=os.getenv('GROQ_API'),
+            http_client=upstream.http,
+            http_async_client=upstream.async_http,
+            max_retries=0,
+            model_name="llama-3.1-8b-instant",
+            temperature=0,
+            max_tokens=300
+        )
+
+    def reconnect(self) -> None:
+        """Rebind the models to the upstream pools after the app lifespan reopened them.
+
+        Sessions, summaries and caches are kept; only the models and their compiled chains are rebuilt.
+        """
+        if self._pools[0] is upstream.http and self._pools[1] is upstream.async_http:
+            return
+        self._build_models()
+        self.agents.set_llms({"router": self.router_llm, "agent": self.agent_llm})
+        self.context_window.set_llm(self.summary_llm)
 
     async def route_message(self, state: ChatState) -> ChatState:
         print("Routing message")  # Debug
+        if state["agent_type"]:
+            # Already routed before entering the graph
+            return state
+        
         messages = state["messages"]    
         last_message = cast(HumanMessage, messages[-1])
         
-        chain = self.router_prompt | self.router_llm
+        agent_type = self._route_locally(last_message.content)
+        if agent_type is None:
+            agent_type = await self._route_with_llm(last_message.content)
+        
+        state["agent_type"] = agent_type
+        return state
+
+    def _route_locally(self, message: str) -> Optional[AgentType]:
+        # Repeated openers reuse the router's earlier (temperature 0) decision
+        cached = self.routing_cache.get(self._routing_cache_key(message))
+        if cached is not None:
+            print(f"Routed from cache to: {cached.value}")  # Debug
+            return cached
+        
+        # Confident local decisions skip the router round trip entirely
+        label = self.intent_classifier.classify(message)
+        if label is not None:
+            print(f"Routed locally to: {label}")  # Debug
+            return AgentType(label)
+        
+        return None
+
+    async def _route_with_llm(self, message: str) -> AgentType:
+        router = self.agents.get("router")
         # Add debug logging for router payload
-        router_payload = {"message": last_message.content}
+        router_payload = {"message": message}
         print(f"Router API Payload: {router_payload}")  # Debug
-        result = await chain.ainvoke(router_payload)
+        started = time.perf_counter()
+        result = await scheduler.run(
+            "groq", router.llm.model_name, lambda: router.chain.ainvoke(router_payload),
+            tokens=self._estimate_tokens(router, router_payload),
+        )
+        self.intent_classifier.record_router_call(time.perf_counter() - started)
         print(f"Routed to: {result.content}")  # Debug
         
         try:
             agent_type = AgentType(result.content.strip().lower())
-            state["agent_type"] = agent_type
         except ValueError:
-            state["agent_type"] = AgentType.GENERAL
-            
-        return state
+            return AgentType.GENERAL
+        
+        self.routing_cache.set(self._routing_cache_key(message), agent_type)
+        return agent_type
+
+    def _router_prompt_fingerprint(self) -> int:
+        return self.agents.spec("router").fingerprint()
+
+    def _routing_cache_key(self, message: str) -> str:
+        fingerprint = self._router_prompt_fingerprint()
+        if fingerprint != self._routing_cache_prompt:
+            self.routing_cache.clear()
+            self._routing_cache_prompt = fingerprint
+        return " ".join(re.sub(r"[^\w\s]", " ", message.lower()).split())
 
     async def generate_agent_response(self, state: ChatState) -> AsyncGenerator[ChatState, None]:
         print("Generating agent response")
@@ -419,27 +494,118 @@ ALWAYS write in this language: english.
         last_message = cast(HumanMessage, messages[-1])
         agent_type = state["agent_type"]
         
-        prompt = self.agent_prompts[agent_type]
-        chain = prompt | self.agent_llm
-        
-        agent_payload = {
-            "message": last_message.content,
-            "messages": state["history"]
-        }
-        
         new_state = ChatState(
             messages=state["messages"].copy(),
             agent_type=state["agent_type"],
-            history=state["history"]
+            session_id=state["session_id"]
         )
         
-        async for chunk in chain.astream(agent_payload):
+        async for chunk in self._agent_stream(agent_type, last_message.content, state["session_id"]):
             if chunk.content:
                 # print(f"Agent generating chunk: {chunk.content}")
                 # Yield each chunk immediately
                 new_state["messages"] = messages + [AIMessage(content=chunk.content)]
                 yield new_state
 
+    def _agent_stream(self, agent_type: AgentType, message: str, session_id: str, history: Optional[list] = None):
+        agent = self.agents.get(agent_type)
+        if history is None:
+            history = self.context_window.window(session_id, agent_type)
+        agent_payload = {
+            "message": message,
+            "messages": history
+        }
+        if "salary_data" in agent.input_variables:
+            agent_payload["salary_data"] = self._salary_context(message, history)
+        
+        # Queued behind the agent model's Groq budget; a 429 before the first chunk is retried
+        return scheduler.stream(
+            "groq", agent.llm.model_name, lambda: agent.chain.astream(agent_payload),
+            tokens=self._estimate_tokens(agent, agent_payload),
+        )
+
+    def _estimate_tokens(self, agent: CompiledAgent, payload: Dict[str, Any]) -> int:
+        """Prompt tokens (system prompt, inputs and history) plus the model's completion budget."""
+        tokens = estimate_tokens(agent.spec.system) + estimate_tokens(agent.spec.human)
+        for name, value in payload.items():
+            if name == "messages":
+                tokens += sum(estimate_tokens(str(message.content)) for message in value)
+            else:
+                tokens += estimate_tokens(str(value))
+        return tokens + (agent.llm.max_tokens or 0)
+
+    def _salary_context(self, message: str, history: list) -> str:
+        # Only occupations relevant to the conversation reach the prompt; recent user
+        # turns carry context such as the user's current job title
+        recent = [m.content for m in history[-4:] if isinstance(m, HumanMessage) and m.content != message]
+        index = registry.current().occupation_index
+        return format_occupations(index.retrieve(" ".join(recent + [message])))
+
+    def _predict_agent(self, user_id: str) -> AgentType:
+        recent = self.recent_agents.get(user_id)
+        if recent is not None:
+            return recent
+        if self.agent_prior:
+            return self.agent_prior.most_common(1)[0][0]
+        return AgentType.GENERAL
+
+    def _record_route(self, user_id: str, agent_type: AgentType) -> None:
+        self.recent_agents.set(user_id, agent_type)
+        self.agent_prior[agent_type] += 1
+
+    async def _speculative_response(self, user_id: str, message: str) -> AsyncGenerator[Dict[str, Any], None]:
+        guess = self._predict_agent(user_id)
+        # Sized for the guessed agent; reused only if the router confirms it
+        history = self.context_window.window(user_id, guess)
+        buffer: asyncio.Queue = asyncio.Queue()
+        produced = 0
+
+        async def speculate():
+            nonlocal produced
+            try:
+                async for chunk in self._agent_stream(guess, message, user_id, history):
+                    if chunk.content:
+                        produced += 1
+                        buffer.put_nowait(chunk.content)
+            finally:
+                buffer.put_nowait(None)
+
+        print(f"Speculatively generating with: {guess.value}")  # Debug
+        task = asyncio.create_task(speculate())
+        try:
+            agent_type = await self._route_with_llm(message)
+            self._record_route(user_id, agent_type)
+            self.speculation_stats["attempts"] += 1
+            yield {"agent": agent_type.value}
+
+            if agent_type == guess:
+                # Router agreed: keep what was buffered and carry on with the same stream
+                self.speculation_stats["hits"] += 1
+                self.speculation_stats["head_start_tokens"] += produced
+                while (content := await buffer.get()) is not None:
+                    yield {"content": content}
+                await task  # Surface any error raised by the speculative stream
+                return
+
+            await self._discard(task)
+            self.speculation_stats["misses"] += 1
+            self.speculation_stats["wasted_tokens"] += produced
+            # The routed agent gets a window within its own history budget
+            async for chunk in self._agent_stream(agent_type, message, user_id):
+                if chunk.content:
+                    yield {"content": chunk.content}
+        finally:
+            await self._discard(task)
+
+    @staticmethod
+    async def _discard(task: asyncio.Task) -> None:
+        """Cancel the speculative stream and retrieve its outcome, so a failed guess is not logged as unhandled."""
+        task.cancel()
+        # wait() does not raise the task's outcome, so a cancellation aimed at the caller still propagates
+        await asyncio.wait({task})
+        if not task.cancelled():
+            task.exception()
+
     def _create_graph(self) -> StateGraph:
         workflow = StateGraph(ChatState)
         
@@ -452,41 +618,80 @@ ALWAYS write in this language: english.
         
         return workflow.compile()
 
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "routing": self.intent_classifier.stats(),
+            "routing_cache": self.routing_cache.stats(),
+            "agents": self.agents.stats(),
+            "datasets": registry.stats(),
+            "upstream": upstream.stats(),
+            "sessions": self.conversation_history.stats(),
+            "context_window": self.context_window.stats(),
+            "speculation": {
+                "enabled": self.speculative,
+                **self.speculation_stats,
+                "hit_rate": (
+                    self.speculation_stats["hits"] / self.speculation_stats["attempts"]
+                    if self.speculation_stats["attempts"] else 0.0
+                ),
+            },
+        }
+
     async def generate_response(self, user_id: str, message: str) -> AsyncGenerator[Dict[str, Any], None]:
         try:
             print(f"Starting response generation for message: {message}")
             
-            # Initialize or get existing history
-            if user_id not in self.conversation_history:
-                self.conversation_history[user_id] = []
-            
             # Add new message to history
-            self.conversation_history[user_id].append(HumanMessage(content=message))
+            self.conversation_history.append(user_id, HumanMessage(content=message))
+            
+            agent_type = None
+            if self.speculative:
+                agent_type = self._route_locally(message)
+                if agent_type is None:
+                    # The router LLM is needed, so overlap it with the likeliest agent
+                    async for event in self._speculative_response(user_id, message):
+                        yield event
+                    return
             
             state = ChatState(
                 messages=[HumanMessage(content=message)],
-                agent_type="",
-                history=self.conversation_history[user_id]
+                agent_type=agent_type or "",
+                session_id=user_id
             )
             
             first = True
-            async for msg, metadata in self.workflow.astream(state, stream_mode="messages"):
-                if msg.content and not isinstance(msg, HumanMessage):
-                    if msg.content not in [agent_type for agent_type in AgentType]:
-                        yield {"content": msg.content}
-                    # print(f"Yielding content chunk: {msg.content}")
-
-                if isinstance(msg, AIMessageChunk):
-                    if first:
-                        gathered = msg
-                        first = False
-                    else:
-                        gathered = gathered + msg
-
-                    # Handle any tool calls if present
-                    if msg.tool_call_chunks:
-                        print(f"Tool calls: {gathered.tool_calls}")
-
+            async for mode, event in self.workflow.astream(state, stream_mode=["updates", "messages"]):
+                if mode == "updates":
+                    # The route node finishes before any agent token is produced,
+                    # so the routed agent can be reported ahead of the content.
+                    if "route" in event:
+                        routed = AgentType(event["route"]["agent_type"])
+                        self._record_route(user_id, routed)
+                        yield {"agent": routed.value}
+                    continue
+
+                msg, metadata = event
+                # Only forward the agent's own token stream: the router's output
+                # and the full messages echoed back from node state are skipped.
+                if metadata.get("langgraph_node") != "generate" or not isinstance(msg, AIMessageChunk):
+                    continue
+
+                if msg.content:
+                    yield {"content": msg.content}
+
+                if first:
+                    gathered = msg
+                    first = False
+                else:
+                    gathered = gathered + msg
+
+                # Handle any tool calls if present
+                if msg.tool_call_chunks:
+                    print(f"Tool calls: {gathered.tool_calls}")
+
+        except UpstreamBusy:
+            # Rate limited upstream: let the endpoint answer 503 with a Retry-After
+            raise
         except Exception as e:
             print(f"Error in generate_response: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -1,17 +1,33 @@
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
-from llm_service import LLMService, ChatRequest
-from groq_services import GroqServices
-from url_search import PerplexityService
+from groq_services import GroqServices, shortlist_cache, suggestions_cache, transcription_cache
+from url_search import PerplexityService, url_cache
 from models.user_profile import UserProfile
-from grounding_search import PerplexityGenericSearch
+from grounding_search import PerplexityGenericSearch, search_cache
+from transitions import transition_engine
+from dataset_registry import registry
+from uploads import UploadError, UploadTooLarge, receive_upload, upload_openapi
+from clients import timeout_errors, upstream
+from upstream_scheduler import UpstreamBusy
 
-from pathlib import Path
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, List, Optional
+import asyncio
+import json
+import math
 import os
+import threading
+import time
+
+if TYPE_CHECKING:
+    from llm_service import LLMService
+
+class ChatRequest(BaseModel):
+    message: str
 
 class SearchRequest(BaseModel):
     query: str
@@ -19,12 +35,85 @@ class SearchRequest(BaseModel):
 class GenericSearchRequest(BaseModel):
     query: str
 
+class BatchProfilesRequest(BaseModel):
+    profiles: List[UserProfile]
+    concurrency: int = 8
+    timeout: float = 90.0
+
+class TransitionRequest(BaseModel):
+    current_salary: Optional[float] = None
+    current_job: Optional[str] = None
+    region: Optional[str] = None
+    threshold: float = 1.2
+    limit: int = 10
+    sort: str = "salary"
+
+
+# Fast-startup mode (serverless cold starts): datasets and the chat pipeline are loaded
+# by the first request that needs them instead of before the app starts serving
+FAST_STARTUP = os.getenv("FAST_STARTUP", "").lower() in ("1", "true", "yes")
+
+_llm_service: Optional["LLMService"] = None
+_llm_service_lock = threading.Lock()
+
+
+def get_llm_service() -> "LLMService":
+    """The chat pipeline, built on first use. LangChain and LangGraph are imported here, not at startup."""
+    global _llm_service
+    if _llm_service is None:
+        with _llm_service_lock:
+            if _llm_service is None:
+                from llm_service import LLMService
+                _llm_service = LLMService()
+    return _llm_service
+
+
+_llm_service_build = asyncio.Lock()
+
 
-app = FastAPI()
-llm_service = LLMService()
+async def aget_llm_service() -> "LLMService":
+    """get_llm_service() for request handlers: the first build runs in a thread, so other requests keep being served."""
+    if _llm_service is None:
+        async with _llm_service_build:
+            if _llm_service is None:
+                await asyncio.to_thread(get_llm_service)
+    return _llm_service
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not FAST_STARTUP:
+        # Parse every dataset and build the chat pipeline before serving
+        registry.current()
+        get_llm_service()
+    # Hot-reload the datasets when the files change
+    dataset_watcher = asyncio.create_task(registry.watch())
+    # One pooled, keep-alive HTTP client per interface shared by every upstream API call
+    upstream.start()
+    if _llm_service is not None:
+        # A previous lifespan closed the pools the chat models were built on
+        _llm_service.reconnect()
+    yield
+    dataset_watcher.cancel()
+    await upstream.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Configuration
 MAX_FILE_SIZE = 25 * 1024 * 1024  # 25MB
+MAX_BATCH_PROFILES = 500
+MAX_BATCH_CONCURRENCY = 16
+# How long one batch profile may wait in total for a full rate-limit queue before it is reported busy
+BATCH_MAX_QUEUE_SECONDS = float(os.getenv("BATCH_MAX_QUEUE_SECONDS", "300"))
+
+def upstream_busy(e: UpstreamBusy) -> JSONResponse:
+    """503 for a call that could not get through the provider's rate limits in time (see upstream_scheduler.py)."""
+    return JSONResponse(
+        status_code=503,
+        content={"error": "The AI provider is busy, please retry shortly"},
+        headers={"Retry-After": str(math.ceil(e.retry_after))}
+    )
 
 app.add_middleware(
     CORSMiddleware,
@@ -41,17 +130,45 @@ def hello_world():
     return "Hello,World"
     
 
+# Runtime counters for the chat pipeline (routing fast path, caches, ...)
+@app.get("/metrics")
+def metrics():
+    # Before the first chat request (fast startup) only the non-chat counters exist
+    chat = _llm_service.metrics() if _llm_service is not None else {
+        "datasets": registry.stats(),
+        "upstream": upstream.stats(),
+    }
+    return {
+        **chat,
+        "startup": {"fast_startup": FAST_STARTUP, "llm_service_ready": _llm_service is not None},
+        "response_cache": {
+            "url_search": url_cache.stats(),
+            "grounding_search": search_cache.stats(),
+            "transcription": transcription_cache.stats(),
+            "job_suggestions": suggestions_cache.stats(),
+            "job_market_shortlists": shortlist_cache().stats(),
+        },
+    }
+
+
 # Retrieves URLs from Perplexity in a JSON format use {"query":"MESSAGE"}
 @app.post("/url-search")
 async def search(request: SearchRequest):
     try:
         perplexity_service = PerplexityService()
-        response = perplexity_service.chat_request(request.query)
+        response = await perplexity_service.achat_request(request.query)
         
         return JSONResponse(
             status_code=200,
             content={"response": response}
         )
+    except UpstreamBusy as e:
+        return upstream_busy(e)
+    except timeout_errors():
+        return JSONResponse(
+            status_code=504,
+            content={"error": "Search timed out"}
+        )
     except Exception as e:
         print(f"Error in search endpoint: {str(e)}")
         return JSONResponse(
@@ -68,8 +185,9 @@ async def chat(request: ChatRequest):
     try:
 
         response = ""
+        service = await aget_llm_service()
         
-        async for chunk in llm_service.generate_response("default_user", request.message):
+        async for chunk in service.generate_response("default_user", request.message):
             content = chunk.get('content', '')
             if content:
                 response += content  
@@ -81,19 +199,81 @@ async def chat(request: ChatRequest):
             }
         )
     
+    except UpstreamBusy as e:
+        return upstream_busy(e)
     except Exception as e:
         print(f"Error in endpoint generate_response: {str(e)}")
         return "Sorry, something went wrong. Please try again later."
 
 
+# Streaming variant of /chat. Emits newline-delimited JSON events as soon as they are
+# available: {"event": "agent"} once routed, {"event": "token"} per chunk and a final
+# {"event": "done"} with timings, so the client renders from the first token.
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    print(f"Chat stream endpoint received request: {request.message}")
+
+    async def event_stream():
+        started = time.perf_counter()
+        first_token_at = None
+        agent = None
+
+        try:
+            service = await aget_llm_service()
+            async for chunk in service.generate_response("default_user", request.message):
+                if "agent" in chunk:
+                    agent = chunk["agent"]
+                    yield json.dumps({
+                        "event": "agent",
+                        "agent": agent,
+                        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+                    }) + "\n"
+                    continue
+
+                content = chunk.get('content', '')
+                if content:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    yield json.dumps({"event": "token", "content": content}) + "\n"
+
+            finished = time.perf_counter()
+            yield json.dumps({
+                "event": "done",
+                "agent": agent,
+                "time_to_first_token_ms": round((first_token_at - started) * 1000, 1) if first_token_at else None,
+                "total_ms": round((finished - started) * 1000, 1),
+            }) + "\n"
+
+        except UpstreamBusy as e:
+            yield json.dumps({"event": "error", "error": "The AI provider is busy, please retry shortly",
+                              "retry_after": math.ceil(e.retry_after)}) + "\n"
+        except Exception as e:
+            print(f"Error in endpoint chat_stream: {str(e)}")
+            yield json.dumps({"event": "error", "error": "Sorry, something went wrong. Please try again later."}) + "\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="application/x-ndjson",
+        # Stop reverse proxies from buffering the stream into a single response
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/user-profile")
 async def create_profile(user_profile: UserProfile):
     try:
-        res = GroqServices().generate_job_suggestions(user_profile)
+        res = await GroqServices().agenerate_job_suggestions(user_profile)
         return JSONResponse(
             status_code=200,
             content={"suggestions": res}
         )
+    except UpstreamBusy as e:
+        return upstream_busy(e)
+    except timeout_errors():
+        return JSONResponse(
+            status_code=504,
+            content={"error": "Job suggestions timed out"}
+        )
     except Exception as e:
         print(f"Error in user profile endpoint: {str(e)}")
         return JSONResponse(
@@ -101,30 +281,184 @@ async def create_profile(user_profile: UserProfile):
             content={"error": "Failed to generate job suggestions"}
         )
 
-# @app.get("/perplexity")
-# async def say_hello():
-#     return await PerplexityService().chat_request("I'm currently unemployed. How can the uk government assist me in finding me a job")
+# Streaming variant of /user-profile. Emits newline-delimited JSON: {"event": "section"} as
+# each part of the analysis starts, {"event": "token"} per chunk and a final {"event": "done"}
+# with timings, so the profile page renders from the first token.
+@app.post("/user-profile/stream")
+async def create_profile_stream(user_profile: UserProfile):
+    async def event_stream():
+        started = time.perf_counter()
+        first_token_at = None
+        sections = []
+        cached = False
+
+        try:
+            async for update in GroqServices().astream_job_suggestions(user_profile):
+                if "cached" in update:
+                    cached = True
+                    continue
+                if "section" in update:
+                    sections.append(update["section"])
+                    yield json.dumps({
+                        "event": "section",
+                        **update,
+                        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+                    }) + "\n"
+                    continue
+
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                yield json.dumps({"event": "token", "content": update["content"]}) + "\n"
+
+            finished = time.perf_counter()
+            yield json.dumps({
+                "event": "done",
+                "sections": sections,
+                "cached": cached,
+                "time_to_first_token_ms": round((first_token_at - started) * 1000, 1) if first_token_at else None,
+                "total_ms": round((finished - started) * 1000, 1),
+            }) + "\n"
+
+        except UpstreamBusy as e:
+            yield json.dumps({"event": "error", "error": "The AI provider is busy, please retry shortly",
+                              "retry_after": math.ceil(e.retry_after)}) + "\n"
+        except timeout_errors():
+            yield json.dumps({"event": "error", "error": "Job suggestions timed out"}) + "\n"
+        except Exception as e:
+            print(f"Error in endpoint create_profile_stream: {str(e)}")
+            yield json.dumps({"event": "error", "error": "Failed to generate job suggestions"}) + "\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Job suggestions for a cohort of profiles. At most `concurrency` run at once, each limited to
+# `timeout` seconds; results stream back as newline-delimited JSON in completion order.
+@app.post("/user-profile/batch")
+async def create_profiles_batch(request: BatchProfilesRequest):
+    if not request.profiles or len(request.profiles) > MAX_BATCH_PROFILES:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Send between 1 and {MAX_BATCH_PROFILES} profiles"}
+        )
+    if request.timeout <= 0:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "timeout must be positive"}
+        )
+
+    semaphore = asyncio.Semaphore(max(1, min(request.concurrency, MAX_BATCH_CONCURRENCY)))
+    service = GroqServices()
+
+    async def suggest(index: int, user_profile: UserProfile):
+        async with semaphore:
+            # The timeout covers the model call, not the wait for a free slot or for the rate-limit queue
+            started = time.perf_counter()
+            queue_deadline = started + BATCH_MAX_QUEUE_SECONDS
+            try:
+                while True:
+                    try:
+                        suggestions = await asyncio.wait_for(service.agenerate_job_suggestions(user_profile), request.timeout)
+                        break
+                    except UpstreamBusy as e:
+                        # The provider's queue is full: a cohort waits its turn rather than failing, unless
+                        # the budget stays blocked past the deadline (e.g. a daily limit)
+                        if not e.queued or time.perf_counter() + e.retry_after > queue_deadline:
+                            raise
+                        await asyncio.sleep(e.retry_after)
+                return {"event": "result", "index": index, "suggestions": suggestions,
+                        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+            except UpstreamBusy as e:
+                return {"event": "error", "index": index, "error": "The AI provider is busy, please retry shortly",
+                        "retry_after": math.ceil(e.retry_after)}
+            except (asyncio.TimeoutError, *timeout_errors()):
+                return {"event": "error", "index": index, "error": "Job suggestions timed out"}
+            except Exception as e:
+                print(f"Error in batch profile {index}: {str(e)}")
+                return {"event": "error", "index": index, "error": "Failed to generate job suggestions"}
 
-@app.post("/transcript/")
-async def upload_audio(file: UploadFile = File(...)):
-    SAVE_DIR = Path("uploaded_audio")
-    SAVE_DIR.mkdir(exist_ok=True)
+    async def event_stream():
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(suggest(index, profile)) for index, profile in enumerate(request.profiles)]
+        failed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                failed += result["event"] == "error"
+                yield json.dumps(result) + "\n"
 
+            yield json.dumps({
+                "event": "done",
+                "completed": len(tasks) - failed,
+                "failed": failed,
+                "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            }) + "\n"
+        finally:
+            # Client went away: stop the profiles still queued or running
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Ranks better-paid occupations from the salary datasets, adjusted to the user's region. No model call.
+@app.post("/transitions")
+async def transitions(request: TransitionRequest):
     try:
-        if not file:
-            return JSONResponse(
-                status_code=400,
-                content={"error": "No file uploaded"}
-            )
+        result = transition_engine().rank(
+            current_salary=request.current_salary,
+            current_job=request.current_job,
+            region=request.region,
+            threshold=request.threshold,
+            limit=request.limit,
+            sort=request.sort,
+        )
+        return JSONResponse(
+            status_code=200,
+            content=result
+        )
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={"error": str(e)}
+        )
+    except Exception as e:
+        print(f"Error in transitions endpoint: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "Failed to rank transitions"}
+        )
 
-        file_path = SAVE_DIR / file.filename
-        with file_path.open("wb") as audio_file:
-            audio_file.write(await file.read())
+# @app.get("/perplexity")
+# async def say_hello():
+#     return await PerplexityService().chat_request("I'm currently unemployed. How can the uk government assist me in finding me a job")
 
-        filename = os.path.dirname(__file__) + f"/{file_path}"
+# Audio is streamed into a spooled temp file as it arrives; uploads over MAX_FILE_SIZE are rejected mid-stream
+@app.post("/transcript/", openapi_extra=upload_openapi("file"))
+async def upload_audio(request: Request):
+    try:
+        upload = await receive_upload(request, field="file", max_size=MAX_FILE_SIZE)
+    except UploadTooLarge as e:
+        return JSONResponse(
+            status_code=413,
+            content={"error": str(e)}
+        )
+    except UploadError as e:
+        return JSONResponse(
+            status_code=400,
+            content={"error": str(e)}
+        )
 
-        transcription = GroqServices().speech_to_text(filename)
-        os.remove(filename)
+    try:
+        # The transcription owns the upload from here: a shared one may outlive this request
+        transcription = await GroqServices().aspeech_to_text(
+            upload.filename, upload.file, digest=upload.digest, release=upload.close
+        )
 
         return JSONResponse(
             status_code=200,
@@ -133,22 +467,105 @@ async def upload_audio(file: UploadFile = File(...)):
             }
         )
 
+    except UpstreamBusy as e:
+        return upstream_busy(e)
+    except timeout_errors():
+        return JSONResponse(
+            status_code=504,
+            content={"error": "Transcription timed out"}
+        )
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"error": f"An error occurred: {str(e)}"}
         )
+# Streaming variant of /transcript/. Long recordings are split into overlapping segments
+# transcribed in parallel; emits newline-delimited JSON {"event": "segment"} with the new
+# text as each segment is stitched in order, then {"event": "done"} with the full transcription.
+@app.post("/transcript/stream", openapi_extra=upload_openapi("file"))
+async def upload_audio_stream(request: Request):
+    try:
+        upload = await receive_upload(request, field="file", max_size=MAX_FILE_SIZE)
+    except UploadTooLarge as e:
+        return JSONResponse(
+            status_code=413,
+            content={"error": str(e)}
+        )
+    except UploadError as e:
+        return JSONResponse(
+            status_code=400,
+            content={"error": str(e)}
+        )
+
+    async def event_stream():
+        started = time.perf_counter()
+        transcription = ""
+        segments = 0
+        failed = []
+        cached = False
+
+        try:
+            async for update in GroqServices().astream_transcription(upload.filename, upload.file, digest=upload.digest):
+                segment = update["segment"]
+                segments += 1
+                event = {
+                    "index": segment.index,
+                    "start": round(segment.start, 2),
+                    "end": round(segment.end, 2) if segment.end is not None else None,
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+                }
+                if "error" in update:
+                    print(f"Error transcribing segment {segment.index}: {str(update['error'])}")
+                    failed.append(segment.index)
+                    yield json.dumps({"event": "segment_error", **event, "error": "Failed to transcribe this segment"}) + "\n"
+                    continue
+
+                transcription = update["transcription"]
+                cached = update.get("cached", False)
+                yield json.dumps({"event": "segment", **event, "text": update["text"]}) + "\n"
+
+            yield json.dumps({
+                "event": "done",
+                "transcription": transcription,
+                "segments": segments,
+                "failed_segments": failed,
+                "cached": cached,
+                "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            }) + "\n"
+
+        except UpstreamBusy as e:
+            yield json.dumps({"event": "error", "error": "The AI provider is busy, please retry shortly",
+                              "retry_after": math.ceil(e.retry_after)}) + "\n"
+        except Exception as e:
+            print(f"Error in endpoint upload_audio_stream: {str(e)}")
+            yield json.dumps({"event": "error", "error": "Failed to transcribe audio"}) + "\n"
+        finally:
+            upload.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # Grounding Perplexity search endpoint goes here.
 @app.post("/grounding-search")
 async def generic_search(request: GenericSearchRequest):
     try:
         perplexity_service = PerplexityGenericSearch()
-        response = perplexity_service.search(request.query)
+        response = await perplexity_service.asearch(request.query)
         
         return JSONResponse(
             status_code=200,
             content={"response": response}
         )
+    except UpstreamBusy as e:
+        return upstream_busy(e)
+    except timeout_errors():
+        return JSONResponse(
+            status_code=504,
+            content={"error": "Search timed out"}
+        )
     except Exception as e:
         print(f"Error in generic search endpoint: {str(e)}")
         return JSONResponse(
@@ -0,0 +1,116 @@
+# Lexical retrieval over the occupation salary table, so prompts only carry the rows
+# relevant to the conversation instead of the whole dataset.
+#
+# Occupation descriptions are indexed as word-bounded character 4-grams ("nurse",
+# "nurses" and "nursing" share most of their grams) and scored with BM25. The BM25
+# term weights are precomputed into a dense (grams x occupations) NumPy matrix, so a
+# query is one row gather and a column sum.
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from dataset_registry import Occupation
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Words that appear in many descriptions or queries but say nothing about the occupation
+STOPWORDS = frozenset(
+    "a an and the of in on for to with other n e c nec what how much is are do does i my me "
+    "you your can as at be job jobs work working salary salaries pay paid earn earnings".split()
+)
+
+
+def _grams(text: str, n: int = 4) -> List[str]:
+    grams = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        padded = f" {word} "
+        if len(padded) <= n:
+            grams.append(padded)
+        else:
+            grams.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return grams
+
+
+class OccupationIndex:
+    def __init__(self, occupations: Sequence[Occupation], k1: float = 1.2, b: float = 0.75):
+        self.occupations = occupations
+        self.descriptions = [occupation.description for occupation in occupations]
+        self.codes = [occupation.code for occupation in occupations]
+        self.medians = np.array(
+            [occupation.median if occupation.median is not None else np.nan for occupation in occupations],
+            dtype=np.float64,
+        )
+
+        documents = [Counter(_grams(description)) for description in self.descriptions]
+        self.vocabulary: Dict[str, int] = {}
+        for document in documents:
+            for gram in document:
+                self.vocabulary.setdefault(gram, len(self.vocabulary))
+
+        term_frequency = np.zeros((len(self.vocabulary), len(documents)), dtype=np.float32)
+        for column, document in enumerate(documents):
+            for gram, count in document.items():
+                term_frequency[self.vocabulary[gram], column] = count
+
+        lengths = term_frequency.sum(axis=0)
+        document_frequency = (term_frequency > 0).sum(axis=1)
+        idf = np.log(1 + (len(documents) - document_frequency + 0.5) / (document_frequency + 0.5))
+        norm = k1 * (1 - b + b * lengths / lengths.mean())
+        self.weights = (idf[:, None] * term_frequency * (k1 + 1) / (term_frequency + norm)).astype(np.float32)
+
+        # SOC minor group (first three digits) -> occupation rows, best paid first
+        self.groups: Dict[str, List[int]] = {}
+        for row in np.argsort(-np.nan_to_num(self.medians), kind="stable"):
+            self.groups.setdefault(self.codes[row][:3], []).append(int(row))
+
+    def scores(self, query: str) -> np.ndarray:
+        rows = [self.vocabulary[gram] for gram in _grams(query) if gram in self.vocabulary]
+        if not rows:
+            return np.zeros(len(self.occupations), dtype=np.float32)
+        return self.weights[rows].sum(axis=0)
+
+    def search(self, query: str, k: int = 8, min_score: float = 8.0, relative: float = 0.35) -> List[int]:
+        """Row indices of the `k` best-matching occupations, best first.
+
+        Rows must score at least `min_score` (roughly two matching words) and `relative`
+        times the best score, which keeps incidental gram overlaps out of the results.
+        """
+        scores = self.scores(query)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        cutoff = max(min_score, relative * float(scores[top[0]]))
+        return [int(row) for row in top if scores[row] >= cutoff]
+
+    def neighbours(self, row: int, limit: int = 2) -> List[int]:
+        """Best-paid other occupations in the same SOC minor group, i.e. the nearby next steps."""
+        group = self.groups.get(self.codes[row][:3], [])
+        return [other for other in group if other != row][:limit]
+
+    def retrieve(self, query: str, k: int = 8, neighbours: int = 2) -> List[Occupation]:
+        rows: List[int] = []
+        for row in self.search(query, k=k):
+            for candidate in [row] + self.neighbours(row, limit=neighbours):
+                if candidate not in rows:
+                    rows.append(candidate)
+        return [self.occupations[row] for row in rows]
+
+    def lookup(self, title: str) -> Optional[Occupation]:
+        """Best single occupation for a job title, or None if nothing matches."""
+        rows = self.search(title, k=1)
+        return self.occupations[rows[0]] if rows else None
+
+
+def format_occupations(occupations: Sequence[Occupation]) -> str:
+    """Render rows in the same YAML layout as datasets/yr-earnings-occupation.yaml."""
+    if not occupations:
+        return "occupations: []  # no occupation in the dataset matched this conversation"
+    lines = ["occupations:"]
+    for occupation in occupations:
+        lines.append(f"- description: {occupation.description}")
+        lines.append(f"  median: {occupation.median}")
+    return "\n".join(lines)
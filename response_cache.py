@@ -0,0 +1,223 @@
+# Cache for deterministic (temperature 0) upstream answers, such as the Perplexity
+# searches. Lookups go to an in-memory LRU first, then an optional SQLite tier that
+# survives restarts and is shared between workers. Concurrent misses for the same key
+# are coalesced: the first caller fetches, the others await its result (single-flight).
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from ttl_cache import TTLCache
+
+# Set to a file path (e.g. response_cache.db) to keep cached responses across restarts
+CACHE_DB_PATH = os.getenv("RESPONSE_CACHE_DB")
+
+GET_SQL = "SELECT value, expires_at FROM response_cache WHERE key = ?"
+PUT_SQL = "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)"
+PURGE_SQL = "DELETE FROM response_cache WHERE expires_at <= ?"
+
+# Keeps symbols that change the meaning of a query ("c++", "c#", "£30k")
+_PUNCTUATION = re.compile(r"[^\w\s£$%+#]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, drop punctuation that does not change meaning and collapse whitespace."""
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", query.lower())).strip()
+
+
+class SQLiteResponseStore:
+    """Persistent tier: one WAL-mode connection per thread, expired rows purged on open."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, cached_statements=16)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS response_cache (
+                        key TEXT PRIMARY KEY,
+                        value TEXT NOT NULL,
+                        expires_at REAL NOT NULL
+                    ) WITHOUT ROWID
+                """)
+                conn.execute(PURGE_SQL, (time.time(),))
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[tuple]:
+        """Return (value, seconds left) for a live entry, else None."""
+        row = self.connection().execute(GET_SQL, (key,)).fetchone()
+        if row is None:
+            return None
+        remaining = row[1] - time.time()
+        return (row[0], remaining) if remaining > 0 else None
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        conn = self.connection()
+        with conn:
+            conn.execute(PUT_SQL, (key, value, time.time() + ttl))
+
+
+class ResponseCache:
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 6 * 3600, db_path: Optional[str] = CACHE_DB_PATH):
+        self.name = name
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.store = SQLiteResponseStore(db_path) if db_path else None
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.fetches = 0
+        self.fetch_seconds = 0.0
+
+    def key(self, query: str, *context: str) -> str:
+        """Key on the normalised query plus whatever else shapes the answer (model, system prompt)."""
+        digest = hashlib.sha256("\0".join((normalize_query(query),) + context).encode()).hexdigest()[:32]
+        return f"{self.name}:{digest}"
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        if self.store is not None:
+            try:
+                entry = self.store.get(key)
+            except sqlite3.Error as e:
+                print(f"Error reading response cache: {str(e)}")
+                entry = None
+            if entry is not None:
+                value, remaining = entry
+                self.memory.set(key, value, ttl=remaining)
+                self.disk_hits += 1
+                return value
+        return None
+
+    async def aget(self, key: str) -> Optional[str]:
+        """Look up without fetching; the SQLite tier is read off the event loop."""
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        if self.store is not None:
+            value = await asyncio.to_thread(self.get, key)
+        if value is None:
+            self.misses += 1
+        return value
+
+    async def aset(self, key: str, value: str) -> None:
+        if self.store is not None:
+            await asyncio.to_thread(self.set, key, value)
+        else:
+            self.set(key, value)
+
+    def set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        if self.store is not None:
+            try:
+                self.store.set(key, value, self.ttl)
+            except sqlite3.Error as e:
+                print(f"Error writing response cache: {str(e)}")
+
+    def fetch_sync(self, key: str, fetch: Callable[[], str]) -> str:
+        """Blocking variant for the sync service methods (no coalescing)."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        self.misses += 1
+        started = time.perf_counter()
+        value = fetch()
+        self.record_fetch(started)
+        if value:
+            self.set(key, value)
+        return value
+
+    async def fetch(
+        self, key: str, fetch: Callable[[], Awaitable[str]], release: Optional[Callable[[], None]] = None
+    ) -> str:
+        """Return the cached value or the result of one shared `fetch()`.
+
+        `release` frees what `fetch` reads (e.g. an uploaded file). It is called when the
+        shared fetch started by this call finishes, even if this caller has gone away, or
+        right away when this call did not start one.
+        """
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            if release is not None:
+                release()
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            if release is not None:
+                release()
+        else:
+            task = self._inflight[key] = asyncio.ensure_future(self._fill(key, fetch))
+            if release is not None:
+                task.add_done_callback(lambda _: release())
+        # Shielded, so a caller that disconnects does not cancel the fetch the others are awaiting
+        return await asyncio.shield(task)
+
+    async def _fill(self, key: str, fetch: Callable[[], Awaitable[str]]) -> str:
+        try:
+            if self.store is not None:
+                value = await asyncio.to_thread(self.get, key)
+                if value is not None:
+                    return value
+
+            self.misses += 1
+            started = time.perf_counter()
+            try:
+                value = await fetch()
+            except Exception:
+                self.errors += 1
+                raise
+            self.record_fetch(started)
+            if value:
+                await self.aset(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def record_fetch(self, started: float) -> None:
+        self.fetches += 1
+        self.fetch_seconds += time.perf_counter() - started
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.memory_hits + self.disk_hits + self.coalesced
+        lookups = hits + self.misses
+        avg_fetch_ms = self.fetch_seconds / self.fetches * 1000 if self.fetches else 0.0
+        return {
+            "size": len(self.memory),
+            "maxsize": self.memory.maxsize,
+            "ttl": self.ttl,
+            "persistent": self.store is not None,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "avg_fetch_ms": round(avg_fetch_ms, 1),
+            # Every hit or coalesced call skipped one upstream round trip
+            "estimated_saved_ms": round(hits * avg_fetch_ms, 1),
+            "in_flight": len(self._inflight),
+        }
@@ -0,0 +1,166 @@
+# Bounded in-memory conversation store. Sessions are evicted least-recently-used when
+# the store exceeds its session count or memory budget, or once idle past the TTL,
+# and each session keeps only its most recent messages.
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+MESSAGE_TYPES = {
+    "human": HumanMessage,
+    "ai": AIMessage,
+    "system": SystemMessage,
+}
+
+# Short messages ("hi", "thanks", ...) repeat across sessions, so they share one copy
+INTERN_MAX_LENGTH = 64
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token plus per-message framing)."""
+    return len(text) // 4 + 4
+
+
+class StoredMessage:
+    __slots__ = ("role", "content", "size", "tokens")
+
+    def __init__(self, role: str, content: str):
+        self.role = sys.intern(role)
+        self.content = sys.intern(content) if len(content) <= INTERN_MAX_LENGTH else content
+        self.size = sys.getsizeof(self) + sys.getsizeof(self.content)
+        self.tokens = estimate_tokens(content)
+
+    @classmethod
+    def from_message(cls, message: BaseMessage) -> "StoredMessage":
+        return cls(message.type, message.content)
+
+    def to_message(self) -> BaseMessage:
+        return MESSAGE_TYPES[self.role](content=self.content)
+
+
+class Session:
+    __slots__ = ("messages", "size", "appended", "last_access")
+
+    def __init__(self, max_messages: int):
+        self.messages: deque = deque(maxlen=max_messages)
+        self.size = 0
+        self.appended = 0  # Total messages ever appended; the first retained one is at appended - len(messages)
+        self.last_access = time.monotonic()
+
+
+class SessionStore:
+    def __init__(
+        self,
+        max_sessions: int = 10000,
+        max_messages: int = 50,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 24 * 3600,
+    ):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.evictions = 0
+        self.expirations = 0
+        self.truncated_messages = 0
+
+    def append(self, session_id: str, message: BaseMessage) -> None:
+        stored = StoredMessage.from_message(message)
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                session = self._sessions[session_id] = Session(self.max_messages)
+
+            if len(session.messages) == session.messages.maxlen:
+                # deque drops the oldest message on append; keep the byte count in step
+                dropped = session.messages[0]
+                session.size -= dropped.size
+                self._size -= dropped.size
+                self.truncated_messages += 1
+            session.messages.append(stored)
+            session.appended += 1
+            session.size += stored.size
+            self._size += stored.size
+
+            self._enforce_bounds(keep=session_id)
+
+    def messages(self, session_id: str) -> List[BaseMessage]:
+        with self._lock:
+            session = self._touch(session_id)
+            stored = list(session.messages) if session is not None else []
+        return [message.to_message() for message in stored]
+
+    def snapshot(self, session_id: str) -> Tuple[int, List[StoredMessage]]:
+        """Return the retained messages together with the absolute index of the first one."""
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                return 0, []
+            return session.appended - len(session.messages), list(session.messages)
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._size -= session.size
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _touch(self, session_id: str):
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+
+        now = time.monotonic()
+        if now - session.last_access > self.ttl:
+            self._remove(session_id)
+            self.expirations += 1
+            return None
+
+        session.last_access = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _remove(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id)
+        self._size -= session.size
+
+    def _enforce_bounds(self, keep: str) -> None:
+        # Sessions are kept in access order, so idle ones sit at the front
+        now = time.monotonic()
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if now - oldest.last_access <= self.ttl:
+                break
+            self._remove(oldest_id)
+            self.expirations += 1
+
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self._size > self.max_bytes):
+            oldest_id = next(iter(self._sessions))
+            if oldest_id == keep:
+                break
+            self._remove(oldest_id)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "max_messages": self.max_messages,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "truncated_messages": self.truncated_messages,
+        }
@@ -0,0 +1,138 @@
+# LLM-free career transition ranking. Occupation medians live in a NumPy array and are
+# scaled by a regional earnings factor (region median / UK median), so ranking every
+# occupation for a salary is a handful of vectorised operations.
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from dataset_registry import DatasetSnapshot, Region, registry
+
+NATIONAL_REGION = "United Kingdom"
+
+
+class TransitionEngine:
+    def __init__(self, snapshot: DatasetSnapshot):
+        self.index = snapshot.occupation_index
+        self.titles = self.index.descriptions
+        self.codes = self.index.codes
+        self.medians = np.nan_to_num(self.index.medians)
+        self.sub_major_groups = np.array([code[:2] for code in self.codes])
+        self.minor_groups = np.array([code[:3] for code in self.codes])
+
+        # Prefer the annual earnings ratio; weekly earnings fill the gaps where the annual figure is missing
+        annual = {region.code: region for region in snapshot.annual_regions}
+        weekly = {region.code: region for region in snapshot.weekly_regions}
+        national_code = next(code for code, region in annual.items() if region.name == NATIONAL_REGION)
+        self.regions: Dict[str, Tuple[str, float]] = {}
+        for code in annual.keys() | weekly.keys():
+            factor = _ratio(annual.get(code), annual[national_code]) or _ratio(weekly.get(code), weekly.get(national_code))
+            if factor:
+                name = (annual.get(code) or weekly[code]).name
+                self.regions[code.lower()] = (name, factor)
+                self.regions.setdefault(_region_key(name), (name, factor))
+
+    def region_factor(self, location: Optional[str]) -> Tuple[str, float]:
+        """Resolve a region name, ONS code or free-text location ("Leeds, West Yorkshire") to its earnings factor."""
+        if location:
+            for part in [location] + location.split(","):
+                match = self.regions.get(part.strip().lower()) or self.regions.get(_region_key(part))
+                if match:
+                    return match
+        return NATIONAL_REGION, 1.0
+
+    def rank(
+        self,
+        current_salary: Optional[float] = None,
+        current_job: Optional[str] = None,
+        region: Optional[str] = None,
+        threshold: float = 1.2,
+        limit: int = 10,
+        sort: str = "salary",
+    ) -> Dict:
+        """Rank occupations paying at least `threshold` times the current salary once adjusted to the region.
+
+        When no salary is given it is taken from the occupation best matching `current_job`.
+        `sort="relevance"` puts occupations close to the current one first (same SOC
+        minor group, same sub-major group, similar description), then orders by salary.
+        """
+        if sort not in ("salary", "relevance"):
+            raise ValueError("sort must be 'salary' or 'relevance'")
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        if threshold <= 0:
+            raise ValueError("threshold must be positive")
+
+        region_name, factor = self.region_factor(region)
+        regional = self.medians * factor
+
+        current = None
+        if current_job:
+            matches = self.index.search(current_job, k=1)
+            if matches:
+                row = matches[0]
+                current = {
+                    "title": self.titles[row],
+                    "code": self.codes[row],
+                    "salary": float(self.medians[row]),
+                    "regional_salary": round(float(regional[row]), 2),
+                }
+        if current_salary is None:
+            if current is None:
+                raise ValueError("Either current_salary or a recognisable current_job is required")
+            current_salary = current["regional_salary"]
+        if current_salary <= 0:
+            raise ValueError("current_salary must be positive")
+
+        candidates = np.flatnonzero(regional > current_salary * threshold)
+        if sort == "relevance" and current is not None:
+            scores = self.index.scores(current_job)
+            affinity = (
+                (self.minor_groups == current["code"][:3]).astype(np.int8)
+                + (self.sub_major_groups == current["code"][:2])
+                + (scores >= max(8.0, 0.35 * float(scores.max())))
+            )
+            candidates = candidates[np.lexsort((-regional[candidates], -affinity[candidates]))][:limit]
+        else:
+            if len(candidates) > limit:
+                candidates = candidates[np.argpartition(-regional[candidates], limit - 1)[:limit]]
+            candidates = candidates[np.argsort(-regional[candidates], kind="stable")]
+
+        increase = regional[candidates] - current_salary
+        percentage = increase / current_salary * 100
+        return {
+            "region": region_name,
+            "regional_factor": round(factor, 4),
+            "current_salary": current_salary,
+            "current": current,
+            "transitions": [
+                {
+                    "title": self.titles[row],
+                    "code": self.codes[row],
+                    "salary": float(self.medians[row]),
+                    "regional_salary": round(float(regional[row]), 2),
+                    "increase": round(float(uplift), 2),
+                    "percentage": round(float(percent), 1),
+                }
+                for row, uplift, percent in zip(candidates, increase, percentage)
+            ],
+        }
+
+
+def _region_key(name: str) -> str:
+    """Normalise a region name so "York UA" and "West Yorkshire Met County" match "york" and "west yorkshire"."""
+    key = name.strip().lower()
+    for suffix in (" ua", " met county"):
+        if key.endswith(suffix):
+            key = key[:-len(suffix)]
+    return key
+
+
+def _ratio(region: Optional[Region], national: Optional[Region]) -> Optional[float]:
+    if not region or not national or not region.earnings or not national.earnings:
+        return None
+    return region.earnings / national.earnings
+
+
+def transition_engine() -> TransitionEngine:
+    """The engine for the current dataset version, built once per version."""
+    return registry.current().derived("transition_engine", TransitionEngine)
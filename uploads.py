@@ -0,0 +1,168 @@
+# Streaming multipart upload for audio files. The request body is parsed chunk by chunk
+# as it arrives and the file part is spooled into a temporary file (in memory up to
+# SPOOL_SIZE, then on disk), so memory per upload stays bounded and the size limit is
+# enforced while the body is still streaming in rather than after it has been buffered.
+import asyncio
+import hashlib
+import tempfile
+from typing import Dict, List, Optional
+
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+
+SPOOL_SIZE = 1024 * 1024  # 1MB in memory before rolling over to an anonymous temp file
+# Room for the multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadError(Exception):
+    """The request is not a usable multipart upload (400)."""
+
+
+class UploadTooLarge(Exception):
+    """The uploaded file exceeds the size limit (413)."""
+
+
+class SpooledUpload:
+    def __init__(self, spool_size: int = SPOOL_SIZE):
+        # Unnamed, per-upload temp file: concurrent uploads never collide and it is deleted on close
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_size, prefix="upload-")
+        self.spool_size = spool_size
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self.size = 0  # Bytes written so far
+        # Content hash, updated chunk by chunk as the file streams in
+        self.sha256 = hashlib.sha256()
+
+    @property
+    def digest(self) -> str:
+        return self.sha256.hexdigest()
+
+    @property
+    def on_disk(self) -> bool:
+        # SpooledTemporaryFile rolls over once more than spool_size bytes have been written
+        return self.size > self.spool_size
+
+    async def write(self, data: bytes) -> None:
+        self.sha256.update(data)
+        self.size += len(data)
+        # The write that crosses spool_size creates the disk file and copies the buffer into it;
+        # it and every later write go through a thread so the event loop never blocks
+        if self.on_disk:
+            await asyncio.to_thread(self.file.write, data)
+        else:
+            self.file.write(data)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def upload_openapi(field: str = "file") -> Dict:
+    """OpenAPI request body for a route that reads `field` with receive_upload.
+
+    The route takes the raw Request, so FastAPI cannot infer the multipart form; pass this
+    as `openapi_extra` to keep the file field in the schema and in Swagger's "Try it out".
+    """
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {field: {"type": "string", "format": "binary"}},
+                        "required": [field],
+                    }
+                }
+            },
+        }
+    }
+
+
+async def receive_upload(request: Request, field: str = "file", max_size: int = 25 * 1024 * 1024) -> SpooledUpload:
+    """Stream the `field` file part of a multipart request into a SpooledUpload.
+
+    Raises UploadTooLarge as soon as more than `max_size` bytes of file data have
+    arrived and UploadError if the body is not multipart or has no such file part.
+    The caller owns the returned upload and must close() it.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type"))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("Expected a multipart/form-data upload")
+
+    # Reject early when the client announces a body that cannot fit
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_size + MULTIPART_OVERHEAD:
+        raise UploadTooLarge(f"File exceeds the {max_size // (1024 * 1024)}MB limit")
+
+    upload = SpooledUpload()
+    pending: List[bytes] = []
+    part: Dict[str, bytes] = {}
+    header = {"field": b"", "value": b""}
+    state = {"in_file": False, "found": False, "received": 0}
+
+    def on_part_begin():
+        part.clear()
+
+    def on_header_field(data: bytes, start: int, end: int):
+        header["field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        part[header["field"].lower().decode("latin-1")] = header["value"]
+        header["field"] = header["value"] = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(part.get("content-disposition"))
+        state["in_file"] = (
+            not state["found"]
+            and options.get(b"name", b"").decode("utf-8", "replace") == field
+            and b"filename" in options
+        )
+        if state["in_file"]:
+            state["found"] = True
+            upload.filename = options[b"filename"].decode("utf-8", "replace")
+            upload.content_type = part.get("content-type", b"").decode("latin-1") or None
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if state["in_file"]:
+            state["received"] += end - start
+            if state["received"] > max_size:
+                raise UploadTooLarge(f"File exceeds the {max_size // (1024 * 1024)}MB limit")
+            pending.append(data[start:end])
+
+    def on_part_end():
+        state["in_file"] = False
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except MultipartParseError as e:
+                raise UploadError(f"Malformed multipart body: {str(e)}")
+            if pending:
+                data = b"".join(pending)
+                pending.clear()
+                await upload.write(data)
+        parser.finalize()
+
+        if not state["found"]:
+            raise UploadError(f"No file uploaded in field '{field}'")
+        upload.file.seek(0)
+        return upload
+    except BaseException:
+        upload.close()
+        raise
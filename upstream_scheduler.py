@@ -0,0 +1,384 @@
+# Shared rate-limit scheduler for the upstream APIs (Groq and Perplexity). Every
+# provider/model pair has a token bucket for requests per minute and one for tokens per
+# minute. A call reserves its share of both before it is sent and sleeps until its slot
+# comes up, so a burst turns into a short local queue instead of a wave of 429s.
+#
+# Budgets start from the defaults below and then follow the x-ratelimit-* and retry-after
+# headers of every response (fed in by the httpx response hooks in clients.py). A 429
+# that still gets through pauses the whole bucket; it and the other transient failures
+# are retried with jittered exponential backoff (tenacity). The SDKs' own retries are
+# turned off so every attempt goes through the buckets.
+import asyncio
+import contextvars
+import os
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Mapping, Optional, Tuple, TypeVar
+
+from tenacity import AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+T = TypeVar("T")
+
+# Starting budgets (requests/min, tokens/min) until response headers report the real ones
+DEFAULT_LIMITS = {
+    "groq": (int(os.getenv("GROQ_RPM", "30")), int(os.getenv("GROQ_TPM", "30000"))),
+    "perplexity": (int(os.getenv("PERPLEXITY_RPM", "50")), int(os.getenv("PERPLEXITY_TPM", "100000"))),
+}
+# A call that would wait longer than this in the local queue fails fast with UpstreamBusy
+MAX_QUEUE_SECONDS = float(os.getenv("UPSTREAM_MAX_QUEUE_SECONDS", "20"))
+# Attempts per call when the provider answers 429 (or another retryable error)
+MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "4"))
+# Completion budget assumed for requests that do not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1024
+
+# The bucket of the call in flight, so response hooks know which budget the headers describe
+_current: contextvars.ContextVar[Optional["RateLimit"]] = contextvars.ContextVar("upstream_rate_limit", default=None)
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)?")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0, None: 1.0}
+
+
+class UpstreamBusy(Exception):
+    """The provider's queue is longer than MAX_QUEUE_SECONDS, or it kept answering 429 (503).
+
+    `queued` is True when the call was turned away by the local queue: nothing was sent, and
+    the budget frees up after `retry_after` seconds.
+    """
+
+    def __init__(self, message: str, retry_after: float, queued: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.queued = queued
+
+
+def _duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in a rate-limit header: "2", "7.66s", "2m59.56s" or "500ms"."""
+    if not value:
+        return None
+    parts = _DURATION.findall(value.strip())
+    if not parts:
+        return None
+    return sum(float(number) * _UNITS[unit or None] for number, unit in parts)
+
+
+def _number(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    # Both SDKs (and LangChain's ChatGroq, which wraps the groq SDK) raise status errors carrying the code
+    return getattr(error, "status_code", None) == 429
+
+
+def is_retryable(error: BaseException) -> bool:
+    """The failures the SDKs' own retries covered: 408, 409, 429, 5xx and dropped connections.
+
+    Timeouts are not retried; they already waited out the per-call timeout.
+    """
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    # Only reached once an SDK call has raised, so the SDKs are already imported
+    from groq import APIConnectionError as GroqConnectionError, APITimeoutError as GroqTimeoutError
+    from openai import APIConnectionError as OpenAIConnectionError, APITimeoutError as OpenAITimeoutError
+    return (
+        isinstance(error, (GroqConnectionError, OpenAIConnectionError))
+        and not isinstance(error, (GroqTimeoutError, OpenAITimeoutError))
+    )
+
+
+def chat_tokens(request: Mapping[str, Any]) -> int:
+    """Token estimate for a chat completion request: prompt (~4 characters per token) plus completion budget."""
+    prompt = sum(len(str(message.get("content", ""))) for message in request.get("messages", ())) // 4
+    return prompt + (request.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+
+class TokenBucket:
+    """Refills `capacity` units per minute. Reservations may take it below zero: later callers wait longer."""
+
+    __slots__ = ("capacity", "level", "updated")
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available."""
+        self._refill(now)
+        deficit = min(amount, self.capacity) - self.level
+        return deficit * 60 / self.capacity if deficit > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def clamp(self, remaining: float, now: float) -> None:
+        """The provider says only `remaining` units are left."""
+        self._refill(now)
+        self.level = min(self.level, remaining)
+
+    def resize(self, capacity: float) -> None:
+        if capacity > 0 and capacity != self.capacity:
+            self.level = min(self.level + capacity - self.capacity, capacity)
+            self.capacity = capacity
+
+
+class RateLimit:
+    """Request and token budgets for one provider/model. Guarded by the scheduler's lock."""
+
+    def __init__(self, provider: str, model: str, rpm: int, tpm: int):
+        self.provider = provider
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0  # Set by 429s and exhausted budgets; everyone waits it out
+
+        self.sent = 0
+        self.queued = 0
+        self.delayed = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.rejected = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.header_updates = 0
+
+    def reserve(self, tokens: int, max_wait: float, retry: bool = False) -> float:
+        """Take one request and `tokens` from the budgets and return how long to wait before sending.
+
+        New calls are turned away when the queue ahead of them is longer than `max_wait`. A
+        retry was admitted already, so it only gives up when the provider asks for a longer pause.
+        """
+        now = time.monotonic()
+        blocked = self.blocked_until - now
+        delay = max(
+            blocked,
+            self.requests.delay(1, now),
+            self.tokens.delay(tokens, now) if tokens else 0.0,
+        )
+        if (blocked if retry else delay) > max_wait:
+            self.rejected += 1
+            raise UpstreamBusy(f"{self.provider} {self.model} is busy, retry in {delay:.0f}s", delay, queued=True)
+        self.requests.take(1)
+        if tokens:
+            self.tokens.take(tokens)
+        self.sent += 1
+        if delay > 0:
+            self.delayed += 1
+            self.wait_seconds += delay
+            self.max_wait_seconds = max(self.max_wait_seconds, delay)
+        return delay
+
+    def retry_after(self) -> float:
+        return max(self.blocked_until - time.monotonic(), 1.0)
+
+    def observe(self, status: int, headers: Mapping[str, str]) -> None:
+        now = time.monotonic()
+        remaining_requests = _number(headers.get("x-ratelimit-remaining-requests"))
+        remaining_tokens = _number(headers.get("x-ratelimit-remaining-tokens"))
+        limit_tokens = _number(headers.get("x-ratelimit-limit-tokens"))
+        reset_requests = _duration(headers.get("x-ratelimit-reset-requests"))
+        reset_tokens = _duration(headers.get("x-ratelimit-reset-tokens"))
+
+        if any(value is not None for value in (remaining_requests, remaining_tokens, limit_tokens)):
+            self.header_updates += 1
+        # The requests limit header is per minute for some providers and per day for Groq,
+        # so only what is left (and when it resets) is trusted for requests
+        if limit_tokens:
+            self.tokens.resize(int(limit_tokens))
+        if remaining_tokens is not None:
+            self.tokens.clamp(remaining_tokens, now)
+        if remaining_requests is not None:
+            self.requests.clamp(remaining_requests, now)
+
+        pause = None
+        if remaining_requests is not None and remaining_requests <= 0:
+            pause = reset_requests
+        if remaining_tokens is not None and remaining_tokens <= 0 and reset_tokens:
+            pause = max(pause or 0.0, reset_tokens)
+        if status == 429:
+            self.rate_limited += 1
+            pause = _duration(headers.get("retry-after")) or pause or 1.0
+        if pause:
+            self.blocked_until = max(self.blocked_until, now + pause)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "rpm": self.requests.capacity,
+            "tpm": self.tokens.capacity,
+            "requests_available": round(max(self.requests.level, 0.0), 1),
+            "tokens_available": round(max(self.tokens.level, 0.0)),
+            "blocked_for_s": round(max(self.blocked_until - now, 0.0), 1),
+            "sent": self.sent,
+            "queued": self.queued,
+            "delayed": self.delayed,
+            "avg_wait_ms": round(self.wait_seconds / self.delayed * 1000, 1) if self.delayed else 0.0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 1),
+            "rejected": self.rejected,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+            "header_updates": self.header_updates,
+        }
+
+
+class UpstreamScheduler:
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Tuple[int, int]]] = None,
+        max_queue_seconds: float = MAX_QUEUE_SECONDS,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        self.default_limits = limits or DEFAULT_LIMITS
+        self.max_queue_seconds = max_queue_seconds
+        self.max_attempts = max_attempts
+        self._limits: Dict[Tuple[str, str], RateLimit] = {}
+        # Plain lock around cheap bookkeeping; waiting happens outside it, so it works for sync and async callers
+        self._lock = threading.Lock()
+
+    def limit(self, provider: str, model: str) -> RateLimit:
+        key = (provider, model)
+        limit = self._limits.get(key)
+        if limit is None:
+            with self._lock:
+                limit = self._limits.get(key)
+                if limit is None:
+                    rpm, tpm = self.default_limits[provider]
+                    limit = self._limits[key] = RateLimit(provider, model, rpm, tpm)
+        return limit
+
+    def _reserve(self, limit: RateLimit, tokens: int, attempt) -> float:
+        with self._lock:
+            delay = limit.reserve(tokens, self.max_queue_seconds, retry=attempt.retry_state.attempt_number > 1)
+            if delay > 0:
+                limit.queued += 1
+        return delay
+
+    def _dequeue(self, limit: RateLimit) -> None:
+        with self._lock:
+            limit.queued -= 1
+
+    def _retry_policy(self, limit: RateLimit) -> Dict[str, Any]:
+        def record_retry(state) -> None:
+            with self._lock:
+                limit.retries += 1
+            error = state.outcome.exception()
+            print(f"Retrying {limit.provider} ({limit.model}) after: {str(error)}, attempt {state.attempt_number}")  # Debug
+
+        return dict(
+            retry=retry_if_exception(is_retryable),
+            # Jitter spreads the retries of a burst; the bucket pause (retry-after) comes on top
+            wait=wait_random_exponential(multiplier=0.5, max=8),
+            stop=stop_after_attempt(self.max_attempts),
+            before_sleep=record_retry,
+            reraise=True,
+        )
+
+    def _busy(self, limit: RateLimit, error: BaseException) -> UpstreamBusy:
+        return UpstreamBusy(f"{limit.provider} {limit.model} is rate limited: {str(error)}", limit.retry_after())
+
+    async def _wait(self, limit: RateLimit, tokens: int, attempt) -> None:
+        delay = self._reserve(limit, tokens, attempt)
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._dequeue(limit)
+
+    async def run(self, provider: str, model: str, call: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+        """Await `call()` once the provider/model budgets allow it, retrying on 429."""
+        limit = self.limit(provider, model)
+        try:
+            async for attempt in AsyncRetrying(**self._retry_policy(limit)):
+                with attempt:
+                    await self._wait(limit, tokens, attempt)
+                    token = _current.set(limit)
+                    try:
+                        return await call()
+                    finally:
+                        _current.reset(token)
+        except Exception as e:
+            if is_rate_limited(e):
+                raise self._busy(limit, e) from e
+            raise
+
+    def run_sync(self, provider: str, model: str, call: Callable[[], T], tokens: int = 0) -> T:
+        """Blocking variant of run() for the sync service methods."""
+        limit = self.limit(provider, model)
+        try:
+            for attempt in Retrying(**self._retry_policy(limit)):
+                with attempt:
+                    delay = self._reserve(limit, tokens, attempt)
+                    if delay > 0:
+                        try:
+                            time.sleep(delay)
+                        finally:
+                            self._dequeue(limit)
+                    token = _current.set(limit)
+                    try:
+                        return call()
+                    finally:
+                        _current.reset(token)
+        except Exception as e:
+            if is_rate_limited(e):
+                raise self._busy(limit, e) from e
+            raise
+
+    async def stream(self, provider: str, model: str, start: Callable[[], AsyncIterator[T]], tokens: int = 0) -> AsyncIterator[T]:
+        """Iterate `start()` once the budgets allow it.
+
+        Only the request itself (up to the first chunk) is retried on 429; a stream that
+        fails part-way through is not replayed, since its chunks have already been passed on.
+        """
+        limit = self.limit(provider, model)
+        done = object()
+        try:
+            async for attempt in AsyncRetrying(**self._retry_policy(limit)):
+                with attempt:
+                    await self._wait(limit, tokens, attempt)
+                    iterator = start().__aiter__()
+                    token = _current.set(limit)
+                    try:
+                        first = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        first = done
+                    except BaseException:
+                        aclose = getattr(iterator, "aclose", None)
+                        if aclose is not None:
+                            await aclose()
+                        raise
+                    finally:
+                        _current.reset(token)
+        except Exception as e:
+            if is_rate_limited(e):
+                raise self._busy(limit, e) from e
+            raise
+
+        if first is done:
+            return
+        yield first
+        async for chunk in iterator:
+            yield chunk
+
+    def observe(self, status: int, headers: Mapping[str, str]) -> None:
+        """Update the budgets of the call in flight from its response status and headers."""
+        limit = _current.get()
+        if limit is None:
+            return
+        with self._lock:
+            limit.observe(status, headers)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {f"{limit.provider}/{limit.model}": limit.stats() for limit in self._limits.values()}
+
+
+scheduler = UpstreamScheduler()
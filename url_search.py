@@ -1,15 +1,29 @@
-import os
-from openai import OpenAI
+from typing import TYPE_CHECKING, Optional
 from dotenv import load_dotenv
+from clients import upstream
+from upstream_scheduler import chat_tokens, scheduler
+from response_cache import ResponseCache
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
 
 load_dotenv()
 
 
+# Seconds allowed for one Perplexity call before giving up
+REQUEST_TIMEOUT = 30.0
+
+# Temperature 0 answers for the same query, kept for a day
+url_cache = ResponseCache("url_search", maxsize=2048, ttl=24 * 3600)
+
+
 class PerplexityService:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("PERPLEXITY_API_KEY"), base_url="https://api.perplexity.ai")
+    def __init__(self, client: Optional["OpenAI"] = None, async_client: Optional["AsyncOpenAI"] = None):
+        # Shared, keep-alive pooled clients by default (see clients.py)
+        self.client = client or upstream.perplexity
+        self.async_client = async_client or upstream.async_perplexity
 
-    def chat_request(self, query: str):
+    def _request(self, query: str):
         messages = [
             {
                 "role": "system",
@@ -25,15 +39,53 @@ class PerplexityService:
             },
         ]
 
-        response = self.client.chat.completions.create(
+        return dict(
             model="llama-3.1-sonar-large-128k-online",
             messages=messages,
             temperature=0,
             presence_penalty=0.5,  # Adjusted presence penalty for better diversity
             frequency_penalty=1,  # Adjusted frequency penalty to reduce repetition
-            stream=False
+            stream=False,
+            timeout=REQUEST_TIMEOUT
         )
-        
+
+    def _parse(self, response):
         content = response.choices[0].message.content
         content = content.replace("```json", "").replace("```", "").strip()
         return content
+
+    def _complete(self, request):
+        # Queued behind the Perplexity rate limits and retried on 429 (see upstream_scheduler.py)
+        return scheduler.run_sync(
+            "perplexity",
+            request["model"],
+            lambda: self.client.chat.completions.create(**request),
+            tokens=chat_tokens(request),
+        )
+
+    async def _acomplete(self, request):
+        return await scheduler.run(
+            "perplexity",
+            request["model"],
+            lambda: self.async_client.chat.completions.create(**request),
+            tokens=chat_tokens(request),
+        )
+
+    def _cache_key(self, query: str, request) -> str:
+        return url_cache.key(query, request["model"], request["messages"][0]["content"])
+
+    def chat_request(self, query: str):
+        request = self._request(query)
+        return url_cache.fetch_sync(
+            self._cache_key(query, request),
+            lambda: self._parse(self._complete(request))
+        )
+
+    async def achat_request(self, query: str):
+        request = self._request(query)
+
+        async def fetch():
+            response = await self._acomplete(request)
+            return self._parse(response)
+
+        return await url_cache.fetch(self._cache_key(query, request), fetch)
@@ -0,0 +1,58 @@
+# Measures what the agent registry saves: building every prompt template up front
+# (the old LLMService startup) and composing `prompt | llm` on every request (the old
+# route/generate paths) versus one lazy compile per agent and a lookup per request.
+# No network calls are made. Run from the repository root: python util/bench_agent_chains.py
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("GROQ_API", "bench")
+
+from langchain_groq import ChatGroq
+
+from agent_registry import AgentRegistry
+from llm_service import AGENT_SPECS
+
+ITERATIONS = 2000
+
+llms = {
+    "router": ChatGroq(groq_api_key="bench", model_name="llama-3.1-8b-instant"),
+    "agent": ChatGroq(groq_api_key="bench", model_name="llama-3.1-70b-versatile"),
+}
+
+
+def per_call_us(fn, iterations: int = ITERATIONS) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+# Startup: every template built eagerly, as LLMService.__init__ used to
+startup_eager_ms = per_call_us(lambda: [spec.build_prompt() for spec in AGENT_SPECS], 50) / 1000
+startup_lazy_ms = per_call_us(lambda: AgentRegistry(llms, AGENT_SPECS), 50) / 1000
+print(f"Startup ({len(AGENT_SPECS)} agents): eager templates {startup_eager_ms:.2f} ms, registry {startup_lazy_ms:.3f} ms\n")
+
+registry = AgentRegistry(llms, AGENT_SPECS)
+prompts = {spec.name: spec.build_prompt() for spec in AGENT_SPECS}
+
+print(f"{'agent':<12} {'compile us':>10} {'rebuild us':>10} {'lookup us':>10} {'saved':>7}")
+saved = []
+for spec in AGENT_SPECS:
+    name = getattr(spec.name, "value", spec.name)
+    llm = llms[spec.llm]
+    started = time.perf_counter()
+    registry.get(spec.name)  # First use compiles
+    compile_us = (time.perf_counter() - started) * 1e6
+
+    # Per request before: `prompt | llm` composed on every call
+    rebuild_us = per_call_us(lambda: prompts[spec.name] | llm)
+    # Per request now: the compiled chain is looked up
+    lookup_us = per_call_us(lambda: registry.chain(spec.name))
+    saved.append(rebuild_us - lookup_us)
+    print(f"{name:<12} {compile_us:>10.0f} {rebuild_us:>10.1f} {lookup_us:>10.2f} {rebuild_us / lookup_us:>6.0f}x")
+
+# A routed chat turn composed two runnables: the router chain and the agent chain
+print(f"\nPer routed request: ~{2 * sum(saved) / len(saved):.0f} us of runnable construction removed")
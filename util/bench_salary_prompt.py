@@ -0,0 +1,50 @@
+# Compares the salary data injected into the CAREER/SALARY prompts before (the whole
+# YAML table) and after (occupations retrieved for the message), and times retrieval.
+# Run from the repository root: python util/bench_salary_prompt.py
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataset_registry import registry
+from occupation_index import OccupationIndex, format_occupations
+from session_store import estimate_tokens
+
+QUERIES = [
+    "what salary for nurses",
+    "how do I become an electrician",
+    "I'm a software developer and want to move into management",
+    "I work in a warehouse as a forklift driver, what could I earn elsewhere",
+    "what do chefs earn",
+    "teaching assistant looking for better paid roles",
+    "how much do data analysts make",
+    "I'm a care worker, what are my options",
+]
+ITERATIONS = 1000
+
+snapshot = registry.current()
+full_table = snapshot.occupation_yaml
+occupations = snapshot.occupations
+
+started = time.perf_counter()
+index = OccupationIndex(occupations)
+build_ms = (time.perf_counter() - started) * 1000
+
+full_tokens = estimate_tokens(full_table)
+print(f"Index: {len(occupations)} occupations, {len(index.vocabulary)} grams, built in {build_ms:.1f} ms")
+print(f"Full table: {len(full_table):,} chars, ~{full_tokens:,} tokens\n")
+print(f"{'query':<72} {'rows':>4} {'tokens':>6} {'ratio':>6} {'us':>7}")
+
+ratios = []
+for query in QUERIES:
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        rows = index.retrieve(query)
+    elapsed_us = (time.perf_counter() - started) / ITERATIONS * 1e6
+
+    tokens = estimate_tokens(format_occupations(rows))
+    ratios.append(full_tokens / tokens)
+    print(f"{query[:72]:<72} {len(rows):>4} {tokens:>6} {full_tokens / tokens:>5.1f}x {elapsed_us:>7.0f}")
+
+print(f"\nMean reduction: {sum(ratios) / len(ratios):.1f}x fewer salary-data tokens per turn")
@@ -0,0 +1,81 @@
+# Checks that /user-profile/batch gives up on a rate-limit budget that stays blocked.
+# Profiles wait out a full queue between attempts, but only for BATCH_MAX_QUEUE_SECONDS:
+# a budget blocked for an hour (e.g. a daily limit), or one that keeps refilling too
+# slowly, must end each profile with a busy error event instead of stalling the stream.
+# No upstream calls are made: the blocked budget never lets a request through.
+# Run from the repository root: python util/check_batch_queue.py
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["BATCH_MAX_QUEUE_SECONDS"] = "2"
+os.environ["UPSTREAM_MAX_QUEUE_SECONDS"] = "0.2"
+for name in ("GROQ_API_KEY", "GROQ_API", "PERPLEXITY_API_KEY"):
+    os.environ.setdefault(name, "check")
+
+import httpx
+
+import main
+from upstream_scheduler import scheduler
+
+MODEL = "llama-3.1-70b-versatile"  # The job suggestions model
+
+
+def profiles(tag: str, count: int = 4):
+    return [{"jobs": [], "education": [], "skills": [f"{tag}-{i}"], "location": "Leeds", "wanted_skills": ""}
+            for i in range(count)]
+
+
+async def run_batch(client: httpx.AsyncClient, tag: str):
+    started = time.perf_counter()
+    response = await client.post("/user-profile/batch", json={"profiles": profiles(tag), "concurrency": 2, "timeout": 5})
+    events = [json.loads(line) for line in response.text.splitlines()]
+    return events, time.perf_counter() - started
+
+
+async def reblock(seconds: float) -> None:
+    """Keep the budget blocked `seconds` ahead, as a provider answering with short retry-afters would."""
+    limit = scheduler.limit("groq", MODEL)
+    while True:
+        limit.blocked_until = time.monotonic() + seconds
+        await asyncio.sleep(0.05)
+
+
+def check(name: str, events, elapsed: float, max_seconds: float, min_retry_after: int) -> bool:
+    errors = [event for event in events if event["event"] == "error"]
+    done = events[-1] if events else {}
+    ok = (
+        done.get("event") == "done"
+        and done.get("failed") == len(errors) == 4
+        and all(event.get("retry_after", 0) >= min_retry_after for event in errors)
+        and elapsed <= max_seconds
+    )
+    print(f"{'ok  ' if ok else 'FAIL'} {name}: {len(errors)} busy errors, done={done.get('event') == 'done'}, {elapsed:.1f}s")
+    return ok
+
+
+async def run() -> bool:
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://check", timeout=60) as client:
+        # Blocked for an hour: nothing is worth waiting for, every profile fails at once
+        scheduler.limit("groq", MODEL).blocked_until = time.monotonic() + 3600
+        events, elapsed = await run_batch(client, "daily-limit")
+        results = [check("budget blocked for an hour", events, elapsed, 1.0, 3000)]
+
+        # Blocked again every time it is retried: profiles requeue until their deadline, then fail
+        blocker = asyncio.create_task(reblock(0.5))
+        try:
+            events, elapsed = await run_batch(client, "reblocked")
+        finally:
+            blocker.cancel()
+        # Two slots, so the second pair starts after the first pair's 2s deadline
+        results.append(check("budget blocked on every retry", events, elapsed, 6.0, 1))
+    return all(results)
+
+
+ok = asyncio.run(asyncio.wait_for(run(), 30))
+sys.exit(0 if ok else 1)
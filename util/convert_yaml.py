@@ -1,21 +1,10 @@
-import json
-import yaml
+import os
+import sys
 
-# Read the JSON file
-with open('datasets/yr-earnings-occupation.json', 'r') as json_file:
-    data = json.load(json_file)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Create new structure without codes
-simplified_data = {
-    'occupations': [
-        {
-            'description': occupation['description'],
-            'median': occupation['median']
-        }
-        for occupation in data['occupations']
-    ]
-}
+from dataset_registry import registry
 
-# Write to YAML file
+# The YAML form (occupations without codes) is derived from the JSON by the dataset registry
 with open('output.yaml', 'w') as yaml_file:
-    yaml.dump(simplified_data, yaml_file, sort_keys=False, allow_unicode=True)
+    yaml_file.write(registry.current().occupation_yaml)
@@ -0,0 +1,81 @@
+# Import-time budget for the API process. Runs `python -X importtime -c "import main"`
+# in a fresh interpreter, prints a per-package and per-module breakdown, and exits
+# non-zero when importing main exceeds the budget or eagerly pulls in a provider SDK
+# that should only load on first use (LangChain/LangGraph, groq, openai).
+# Run from the repository root: python util/import_budget.py [budget_ms] [runs]
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Override with the first argument or IMPORT_BUDGET_MS
+BUDGET_MS = float(sys.argv[1] if len(sys.argv) > 1 else os.getenv("IMPORT_BUDGET_MS", "1500"))
+RUNS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+# Loaded lazily by the services that use them; importing any of these from main is a regression
+LAZY_MODULES = ("langchain_groq", "langgraph", "langchain_community", "groq", "openai", "pydantic.v1")
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def measure():
+    """One cold interpreter: (module, depth, self_us, cumulative_us) per import, in import order."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"import main failed:\n{result.stderr[-2000:]}")
+    imports = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, len(indent) // 2, int(self_us), int(cumulative_us)))
+    return imports
+
+
+# Best of several runs, so a noisy machine does not fail the budget
+imports = min((measure() for _ in range(RUNS)), key=lambda run: next(c for m, _, _, c in run if m == "main"))
+total_ms = next(cumulative for module, _, _, cumulative in imports if module == "main") / 1000
+
+packages = defaultdict(int)
+for module, _, self_us, _ in imports:
+    packages[module.split(".")[0]] += self_us
+
+print(f"{'package':<28} {'self ms':>8}")
+for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:15]:
+    print(f"{package:<28} {self_us / 1000:>8.1f}")
+
+# Modules imported directly by main, with everything they pulled in. A parent is
+# reported after its children, so main's children are the depth-1 lines just before it.
+children = []
+for module, depth, _, cumulative_us in imports:
+    if depth == 0:
+        if module == "main":
+            break
+        children = []
+    elif depth == 1:
+        children.append((module, cumulative_us))
+
+print(f"\n{'imported by main':<28} {'cumul ms':>8}")
+for module, cumulative_us in sorted(children, key=lambda child: -child[1]):
+    print(f"{module:<28} {cumulative_us / 1000:>8.1f}")
+
+imported = {module for module, _, _, _ in imports}
+eager = [module for module in LAZY_MODULES if module in imported]
+
+print(f"\nimport main: {total_ms:.0f} ms (budget {BUDGET_MS:.0f} ms, best of {RUNS})")
+failed = False
+if eager:
+    print(f"FAIL: imported eagerly: {', '.join(eager)}")
+    failed = True
+if total_ms > BUDGET_MS:
+    print(f"FAIL: {total_ms - BUDGET_MS:.0f} ms over budget")
+    failed = True
+sys.exit(1 if failed else 0)